@@ -12,15 +12,26 @@
 # limitations under the License.
 
 from search_algorithms.graph_search import graph_search
+from search_algorithms.operator_decomposition import OperatorDecompositionNode, OperatorDecompositionGoalDescription
 from utils import *
 
 
-def classic_agent_type(level, initial_state, action_library, goal_description, frontier):
+def classic_agent_type(level, initial_state, action_library, goal_description, frontier,
+                       operator_decomposition=False, search_algorithm=None):
 
     # Create an action set where all agents can perform all actions
     action_set = [action_library] * level.num_agents
 
-    planning_success, plan = graph_search(initial_state, action_set, goal_description, frontier)
+    # With operator decomposition, the search assigns the action of a single agent at a time
+    if operator_decomposition:
+        initial_state = OperatorDecompositionNode(initial_state)
+        goal_description = OperatorDecompositionGoalDescription(goal_description)
+
+    # Use GRAPH-SEARCH with the given frontier unless another search algorithm is requested
+    if search_algorithm is None:
+        planning_success, plan = graph_search(initial_state, action_set, goal_description, frontier)
+    else:
+        planning_success, plan = search_algorithm(initial_state, action_set, goal_description)
 
     if not planning_success:
         print("Unable to solve level.", file=sys.stderr)
@@ -28,17 +39,9 @@ def classic_agent_type(level, initial_state, action_library, goal_description, f
 
     print(f"Found solution of length {len(plan)}", file=sys.stderr)
 
-    for joint_action in plan:
-
-        # Send the joint action to the server
-        print(joint_action_to_string(joint_action), flush=True)
-        # Uncomment the below line to print the executed actions to the command line for debugging purposes
-        # print(joint_action_to_string(joint_action), file=sys.stderr, flush=True)
-
-        # Read back whether the agents succeeded in performing the joint action
-        execution_successes = parse_response(read_line())
-        if False in execution_successes:
-            print("Execution failed! Stopping...", file=sys.stderr)
-            # One of the agents failed to execute their action.
-            # This should not occur in classical planning and we therefore just abort immediately
-            return
+    # Send the plan to the server while reading back whether the agents succeeded in performing the joint actions
+    if not execute_plan(plan):
+        print("Execution failed! Stopping...", file=sys.stderr)
+        # One of the agents failed to execute their action.
+        # This should not occur in classical planning and we therefore just abort immediately
+        return
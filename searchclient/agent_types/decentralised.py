@@ -24,4 +24,6 @@ def decentralised_agent_type(level, initial_state, action_library, goal_descript
     # use 'print(joint_action_to_string(joint_action), flush=True)' to send a joint_action to the server and
     # use 'parse_response(read_line())' to read back an array of booleans indicating whether each individual action
     #   in the joint action succeeded.
+    # A whole plan which does not depend on the responses can instead be sent using 'execute_plan(plan)', which
+    #   returns whether every joint action succeeded.
     raise NotImplementedError()
@@ -0,0 +1,90 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measures how the parallel search (-workers) scales with the number of worker processes by solving levels with HDA*
+# for each of the given numbers of workers, without the server, e.g.:
+#   python searchclient/benchmark_workers.py -astar -matchingheuristic --workers 1,2,4,8 levels/MAPF03.lvl
+# For every level and number of workers it prints the search time, the speedup relative to the first number of workers,
+# the number of expanded states (which grows with the number of workers due to search overhead) and the plan length.
+
+import argparse
+import sys
+
+from domains.hospital import *
+from search_algorithms.hda_star import hda_star
+
+
+def benchmark_level(level_path, strategy_name, heuristic_name, worker_counts):
+    with open(level_path, "r") as f:
+        level_lines = [line.rstrip() for line in f.read().splitlines()]
+    level = HospitalLevel.parse_level_lines(level_lines)
+    initial_state = HospitalState(level, level.initial_agent_positions, level.initial_box_positions)
+    goal_description = HospitalGoalDescription(level, level.box_goals + level.agent_goals)
+    action_set = [DEFAULT_HOSPITAL_ACTION_LIBRARY] * level.num_agents
+    level.can_push = any(action.name.startswith('Push') for action in DEFAULT_HOSPITAL_ACTION_LIBRARY)
+    level.can_pull = any(action.name.startswith('Pull') for action in DEFAULT_HOSPITAL_ACTION_LIBRARY)
+
+    heuristic = None
+    if strategy_name != 'bfs':
+        if heuristic_name == 'goalcount':
+            heuristic = HospitalGoalCountHeuristics()
+        elif heuristic_name == 'advanced':
+            heuristic = HospitalAdvancedHeuristics()
+        elif heuristic_name == 'matching':
+            heuristic = HospitalMatchingHeuristics()
+        elif heuristic_name == 'pdb':
+            heuristic = HospitalPatternDatabaseHeuristics()
+        heuristic.preprocess(level)
+
+    base_time = None
+    for num_workers in worker_counts:
+        statistics = {}
+        success, plan = hda_star(initial_state, action_set, goal_description, heuristic, strategy_name == 'greedy',
+                                 num_workers, statistics)
+        elapsed_time = statistics.get('time', 0.0)
+        if base_time is None:
+            base_time = elapsed_time
+        speedup = base_time / elapsed_time if elapsed_time > 0 else 1.0
+        plan_length = len(plan) if success else '-'
+        print(f"{level.name:24s} {num_workers:3d} workers {elapsed_time:9.3f} s {speedup:6.2f}x "
+              f"{sum(statistics.get('expanded', [])):10,d} expanded  plan length {plan_length}", flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the parallel search for different numbers of workers.')
+    parser.add_argument('--workers', metavar='<N,...>', type=str, default="1,2,4",
+                        help='A comma separated list of the numbers of workers to benchmark (default 1,2,4).')
+    strategy_group = parser.add_mutually_exclusive_group()
+    strategy_group.add_argument('-bfs', action='store_const', dest='strategy', const='bfs', default='bfs',
+                                help='Expand states in order of path cost (default).')
+    strategy_group.add_argument('-astar', action='store_const', dest='strategy', const='astar',
+                                help='Use the A* strategy.')
+    strategy_group.add_argument('-greedy', action='store_const', dest='strategy', const='greedy',
+                                help='Use the Greedy strategy.')
+    heuristic_group = parser.add_mutually_exclusive_group()
+    heuristic_group.add_argument('-goalcount', action='store_const', dest='heuristic', const='goalcount',
+                                 help='Use a goal count heuristic.')
+    heuristic_group.add_argument('-advancedheuristic', action='store_const', dest='heuristic', const='advanced',
+                                 help='Use an advanced heuristic.')
+    heuristic_group.add_argument('-matchingheuristic', action='store_const', dest='heuristic', const='matching',
+                                 help='Use a heuristic based on minimum cost matchings between boxes and goals.')
+    heuristic_group.add_argument('-pdbheuristic', action='store_const', dest='heuristic', const='pdb',
+                                 help='Use the matching heuristic strengthened by pattern databases of box pairs.')
+    parser.add_argument('levels', metavar='<level>', type=str, nargs='+', help='The level files to benchmark.')
+    args = parser.parse_args()
+
+    if args.strategy != 'bfs' and args.heuristic is None:
+        print("A heuristic must be given for -astar and -greedy", file=sys.stderr)
+        sys.exit(-1)
+    for level_path in args.levels:
+        benchmark_level(level_path, args.strategy, args.heuristic, [int(count) for count in args.workers.split(',')])
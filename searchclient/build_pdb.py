@@ -0,0 +1,48 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Builds the pattern databases used by the pattern database heuristic (-pdbheuristic) for one or more levels and stores
+# them in the level cache, such that the searchclient can memory-map them instead of building them during
+# preprocessing, e.g.:
+#   python searchclient/build_pdb.py --cache-dir cache levels/SAsoko1_128.lvl levels/SAsoko3_128.lvl
+# The searchclient must then be run with the same --cache-dir argument.
+
+import argparse
+import time
+
+from domains.hospital.level import HospitalLevel
+from domains.hospital.pattern_database import load_pattern_databases
+
+
+def build_pattern_databases(level_path, cache_directory):
+    with open(level_path, "r") as f:
+        level_lines = [line.rstrip() for line in f.read().splitlines()]
+    level = HospitalLevel.parse_level_lines(level_lines)
+    level.attach_cache(cache_directory)
+
+    start_time = time.time()
+    pattern_databases = load_pattern_databases(level)
+    letters = ", ".join(sorted(pattern_databases)) or "none"
+    print(f"{level.name}: pattern databases for letters {letters} ready in {time.time() - start_time:.3f} s "
+          f"({level.cache.directory})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the pattern databases of levels ahead of time.')
+    parser.add_argument('--cache-dir', metavar='<path>', type=str, required=True,
+                        help='The level cache directory in which the pattern databases are stored.')
+    parser.add_argument('levels', metavar='<level>', type=str, nargs='+', help='The level files to build for.')
+    args = parser.parse_args()
+
+    for level_path in args.levels:
+        build_pattern_databases(level_path, args.cache_dir)
@@ -14,7 +14,10 @@
 # This file just re-exports the useful classes from the domain
 
 from domains.hospital.actions import *
+from domains.hospital.distances import HospitalDistanceOracle
 from domains.hospital.goal_description import HospitalGoalDescription
-from domains.hospital.heuristics import HospitalGoalCountHeuristics, HospitalAdvancedHeuristics
+from domains.hospital.heuristics import HospitalGoalCountHeuristics, HospitalAdvancedHeuristics, \
+    HospitalMatchingHeuristics, HospitalPatternDatabaseHeuristics
 from domains.hospital.level import HospitalLevel
-from domains.hospital.state import HospitalState
+from domains.hospital.pattern_database import HospitalPatternDatabase
+from domains.hospital.state import HospitalState, CompactHospitalState
@@ -0,0 +1,155 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+from array import array
+from collections import deque
+import sys
+
+from utils import APPROX_INFINITY
+import domains.hospital.level as h_level
+
+# Distances are stored as unsigned 16-bit integers, where this value denotes that the target cannot be reached
+UNREACHABLE = 0xFFFF
+
+
+class HospitalDistanceOracle:
+    """
+    The distance oracle computes the true shortest path distances between cells of a level, i.e. the number of moves
+    needed when taking the walls into account but ignoring all agents and boxes.
+    The distances from a source cell are computed by a breadth-first search the first time they are requested and are
+    afterwards stored as a compact array with one entry per cell in the flattened level grid, such that later lookups
+    take constant time. Every level has a single oracle (see HospitalLevel.distances), which means that the tables
+    are shared between all heuristics and agent types using the same level.
+    """
+
+    def __init__(self, level: h_level.HospitalLevel):
+        self.level = level
+        # Maps the cell index of a source into the array of distances from the source to every cell
+        self.tables = {}
+        # The number of tables already present in the level cache, such that unchanged tables are not stored again
+        self.num_cached_tables = 0
+
+    def distances_from(self, position: tuple[int, int]) -> array:
+        """
+        Returns an array containing the distance from the given position to every cell, indexed by cell index.
+        Unreachable cells contain the value UNREACHABLE. Since moves are reversible, this is also the distance from
+        every cell to the given position.
+        """
+        source = self.level.cell_index(position)
+        table = self.tables.get(source)
+        if table is None:
+            table = self.compute_table(source)
+            self.tables[source] = table
+        return table
+
+    def distance(self, source: tuple[int, int], target: tuple[int, int]) -> int:
+        """Returns the distance between two positions, or APPROX_INFINITY if the target cannot be reached"""
+        distance = self.distances_from(source)[self.level.cell_index(target)]
+        return APPROX_INFINITY if distance == UNREACHABLE else distance
+
+    def nearest_distance(self, sources: list[tuple[int, int]], targets: list[int]) -> int:
+        """
+        Returns the distance from the closest of the source positions to the closest of the target cells (given as cell
+        indices), or APPROX_INFINITY if no target can be reached. Unlike distances_from, the breadth-first search stops
+        at the first target it reaches and nothing is stored, which suits sources that change from state to state.
+        """
+        num_cols = self.level.num_cols
+        num_cells = self.level.num_cells
+        wall_grid = self.level.wall_grid
+        targets = set(targets)
+        reached = bytearray(num_cells)
+        layer = []
+        for position in sources:
+            cell = self.level.cell_index(position)
+            if cell in targets:
+                return 0
+            if not reached[cell]:
+                reached[cell] = 1
+                layer.append(cell)
+        distance = 0
+        while layer:
+            distance += 1
+            next_layer = []
+            for cell in layer:
+                col = cell % num_cols
+                for next_cell in (cell - num_cols if cell >= num_cols else -1,
+                                  cell + num_cols if cell + num_cols < num_cells else -1,
+                                  cell - 1 if col > 0 else -1,
+                                  cell + 1 if col < num_cols - 1 else -1):
+                    if next_cell >= 0 and not reached[next_cell] and not wall_grid[next_cell]:
+                        if next_cell in targets:
+                            return distance
+                        reached[next_cell] = 1
+                        next_layer.append(next_cell)
+            layer = next_layer
+        return APPROX_INFINITY
+
+    def precompute_goal_distances(self):
+        """Computes the distances from every agent and box goal"""
+        for (goal_position, _, _) in self.level.agent_goals + self.level.box_goals:
+            self.distances_from(goal_position)
+
+    def precompute_all_distances(self):
+        """Computes the distances from every free cell. Note that this requires 2 * num_cells^2 bytes of memory"""
+        for (cell, wall) in enumerate(self.level.wall_grid):
+            if not wall:
+                self.distances_from(self.level.cell_position(cell))
+
+    def load_cached_tables(self, cache):
+        """
+        Loads the tables stored in the level cache. The tables are memory-mapped, so they behave like the computed
+        arrays but are only read from disk as they are used.
+        The cached artifact consists of the number of tables and their source cells (as unsigned 32-bit integers)
+        followed by the tables themselves.
+        """
+        data = cache.load('distances')
+        if data is None or len(data) < 4:
+            return
+        num_tables = data[:4].cast('I')[0]
+        tables_offset = 4 + 4 * num_tables
+        num_cells = self.level.num_cells
+        if len(data) != tables_offset + 2 * num_tables * num_cells:
+            print(f"Ignoring corrupt distance tables in {cache.directory}", file=sys.stderr)
+            return
+        sources = data[4:tables_offset].cast('I')
+        tables = data[tables_offset:].cast('H')
+        for (i, source) in enumerate(sources):
+            self.tables.setdefault(source, tables[i * num_cells:(i + 1) * num_cells])
+        self.num_cached_tables = len(self.tables)
+
+    def store_cached_tables(self, cache):
+        """Stores all tables in the level cache, unless no new tables have been computed since they were loaded"""
+        if len(self.tables) == self.num_cached_tables:
+            return
+        sources = sorted(self.tables)
+        cache.store('distances', [array('I', [len(sources)]), array('I', sources)] +
+                    [self.tables[source] for source in sources])
+        self.num_cached_tables = len(self.tables)
+
+    def compute_table(self, source: int) -> array:
+        num_rows = self.level.num_rows
+        num_cols = self.level.num_cols
+        wall_grid = self.level.wall_grid
+        table = array('H', [UNREACHABLE]) * self.level.num_cells
+        table[source] = 0
+        queue = deque([divmod(source, num_cols)])
+        while queue:
+            row, col = queue.popleft()
+            next_distance = table[row * num_cols + col] + 1
+            for (next_row, next_col) in ((row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1)):
+                cell = next_row * num_cols + next_col
+                if 0 <= next_row < num_rows and 0 <= next_col < num_cols and not wall_grid[cell]:
+                    if table[cell] == UNREACHABLE:
+                        table[cell] = next_distance
+                        queue.append((next_row, next_col))
+        return table
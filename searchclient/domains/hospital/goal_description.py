@@ -20,6 +20,10 @@ class HospitalGoalDescription:
     negative goal is satisfied when such an object is *not* at the goal position.
     The 'goal' member contains all goals (both agent and box goals) while 'agent_goal' and 'box_goal' only
     contains one kind. This double representation allows for quick and convenient lookup of goals of a specific kind
+    The goals are furthermore compiled into the 'goals_at' map from positions into the (character, is_positive) pairs
+    of the goals at that position, such that the effect of an object moving can be determined in constant time.
+    HospitalStates use this to keep track of their number of unsatisfied goals incrementally (see
+    HospitalState.count_unsatisfied_goals), which makes the goal test a constant time operation.
     """
 
     def __init__(self, level, goals):
@@ -32,17 +36,42 @@ class HospitalGoalDescription:
                 self.agent_goals.append(goal)
             elif 'A' <= goal[1] <= 'Z':
                 self.box_goals.append(goal)
+        self.goals_at = {}
+        for (goal_position, goal_char, is_positive_literal) in self.goals:
+            self.goals_at.setdefault(goal_position, []).append((goal_char, is_positive_literal))
 
     def is_goal(self, state):
         """Returns whether the given state satisfies all goals in the goal description"""
-        for (goal_position, goal_char, is_positive_literal) in self.goals:
-            char = state.object_at(goal_position)
-            if is_positive_literal and goal_char != char:
-                return False
-            elif not is_positive_literal and goal_char == char:
-                return False
+        return state.count_unsatisfied_goals(self) == 0
+
+    def count_unsatisfied_goals(self, state):
+        """Returns the number of goals in the goal description which are not satisfied by the given state"""
+        unsatisfied_goals = 0
+        for (goal_position, goals) in self.goals_at.items():
+            unsatisfied_goals += self.count_unsatisfied_goals_at(goals, state.object_at(goal_position))
+        return unsatisfied_goals
 
-        return True
+    @staticmethod
+    def count_unsatisfied_goals_at(goals, char):
+        """Returns the number of the given goals (from goals_at) which are unsatisfied when char is at the position"""
+        unsatisfied_goals = 0
+        for (goal_char, is_positive_literal) in goals:
+            if (goal_char == char) != is_positive_literal:
+                unsatisfied_goals += 1
+        return unsatisfied_goals
+
+    def count_unsatisfied_goals_change(self, old_state, new_state, moved_positions):
+        """
+        Returns the change in the number of unsatisfied goals from old_state to new_state, given the (old and new)
+        positions of all objects moved in between
+        """
+        change = 0
+        for position in moved_positions:
+            goals = self.goals_at.get(position)
+            if goals is not None:
+                change += self.count_unsatisfied_goals_at(goals, new_state.object_at(position)) - \
+                          self.count_unsatisfied_goals_at(goals, old_state.object_at(position))
+        return change
 
     def color_filter(self, color):
         """Creates a copy of the goal descriptions where all entities of another color has been removed"""
@@ -18,6 +18,8 @@ from utils import pos_add, pos_sub, APPROX_INFINITY
 import domains.hospital.state as h_state
 import domains.hospital.goal_description as h_goal_description
 import domains.hospital.level as h_level
+import domains.hospital.distances as h_distances
+import domains.hospital.pattern_database as h_pattern_database
 
 class HospitalGoalCountHeuristics:
 
@@ -26,7 +28,8 @@ class HospitalGoalCountHeuristics:
 
     def preprocess(self, level: h_level.HospitalLevel):
         # This function will be called a single time prior to the search allowing us to preprocess the level such as
-        # pre-computing lookup tables or other acceleration structures
+        # pre-computing lookup tables or other acceleration structures.
+        # Note that level.distances already provides (lazily computed) true shortest path distances between cells
         pass
 
     def h(self, state: h_state.HospitalState, goal_description: h_goal_description.HospitalGoalDescription) -> int:
@@ -41,7 +44,8 @@ class HospitalAdvancedHeuristics:
 
     def preprocess(self, level: h_level.HospitalLevel):
         # This function will be called a single time prior to the search allowing us to preprocess the level such as
-        # pre-computing lookup tables or other acceleration structures
+        # pre-computing lookup tables or other acceleration structures.
+        # Note that level.distances already provides (lazily computed) true shortest path distances between cells
         pass
 
 
@@ -49,3 +53,291 @@ class HospitalAdvancedHeuristics:
 
         # Your heuristic goes here...
         return 0
+
+
+class HospitalMatchingHeuristics:
+    """
+    The matching heuristic estimates the number of box moves needed to solve the box goals by matching the boxes of
+    each letter to the box goals of that letter, such that the sum of the true (wall-aware) distances between the
+    matched boxes and goals is minimal. On top of this it adds, for each color, the distance from the closest agent
+    to the closest box of that color which is not on a goal, since an agent must reach a box before it can move it.
+    Once all boxes of a color are solved, the distances of the agents of that color to their agent goals are added.
+    For single-agent levels the heuristic is admissible. States where a box is stuck away from the goals (see
+    HospitalState.is_deadlocked) get an infinite estimate, such that they can be discarded.
+
+    The heuristic is computed incrementally: the matching of the parent state (its boxes, unsolved boxes and matching
+    cost per letter) is remembered while its children are evaluated, so for each child only the letters of the boxes
+    moved since the parent are matched again, and a child where only agents moved reuses the parent's matching as is.
+    The matching costs are also remembered per letter and box configuration, since the same boxes of a letter are
+    often matched again after the other boxes moved.
+    """
+
+    # The maximum number of remembered matching costs before the memory is cleared again
+    MAX_MATCHING_COSTS = 200000
+
+    def __init__(self):
+        self.level = None
+        self.goal_description = None
+        self.matching_costs = {}
+        # The most recent state whose children were evaluated, and its matching (see compute_matching)
+        self.parent = None
+        self.parent_matching = None
+
+    def preprocess(self, level: h_level.HospitalLevel):
+        self.level = level
+        level.distances.precompute_goal_distances()
+
+    def prepare(self, goal_description: h_goal_description.HospitalGoalDescription):
+        """Groups the positive goals of the goal description by letter. Called whenever the goal description changes"""
+        self.goal_description = goal_description
+        self.matching_costs.clear()
+        self.parent = None
+        self.parent_matching = None
+        # Maps box letters into the distance tables of their goals and the cell indices of their goals
+        self.goal_distances = {}
+        self.goal_cells = {}
+        for (goal_position, goal_char, is_positive_literal) in goal_description.box_goals:
+            if is_positive_literal:
+                self.goal_distances.setdefault(goal_char, []).append(self.level.distances.distances_from(goal_position))
+                self.goal_cells.setdefault(goal_char, set()).add(self.level.cell_index(goal_position))
+        self.agent_goals = [(goal_char, goal_position) for (goal_position, goal_char, is_positive_literal)
+                            in goal_description.agent_goals if is_positive_literal]
+
+    def h(self, state: h_state.HospitalState, goal_description: h_goal_description.HospitalGoalDescription) -> int:
+        if goal_description is not self.goal_description:
+            self.prepare(goal_description)
+        if state.is_deadlocked():
+            return APPROX_INFINITY
+        level = self.level
+        colors = level.colors
+
+        matching = self.matching(state)
+        if matching is None:
+            return APPROX_INFINITY
+        _, _, letter_unsolved_boxes, _, h = matching
+        unsolved_boxes_by_color = {}
+        for (letter, unsolved_boxes) in letter_unsolved_boxes.items():
+            if unsolved_boxes:
+                unsolved_boxes_by_color.setdefault(colors[letter], []).extend(unsolved_boxes)
+
+        # Add the distance needed for an agent of each color to get next to an unsolved box of that color
+        agent_positions = {}
+        for (agent_position, agent_char) in state.agent_positions:
+            if agent_char != '':
+                agent_positions[agent_char] = agent_position
+        for (color, unsolved_boxes) in unsolved_boxes_by_color.items():
+            color_agent_positions = [agent_position for (agent_char, agent_position) in agent_positions.items()
+                                     if colors[agent_char] == color]
+            # Boxes of a color without any agents are static, so they cannot contribute
+            if not color_agent_positions:
+                continue
+            # The agents move from state to state, so their distances are not stored in the tables of level.distances
+            closest = level.distances.nearest_distance(color_agent_positions, unsolved_boxes)
+            if closest >= APPROX_INFINITY:
+                return APPROX_INFINITY
+            h += closest - 1
+
+        for (agent_char, goal_position) in self.agent_goals:
+            if colors[agent_char] not in unsolved_boxes_by_color and agent_char in agent_positions:
+                distance = level.distances.distance(goal_position, agent_positions[agent_char])
+                if distance >= APPROX_INFINITY:
+                    return APPROX_INFINITY
+                h += distance
+        return h
+
+    def matching(self, state: h_state.HospitalState):
+        """
+        Returns the matching of the state as computed by compute_matching, updating the matching of its parent if the
+        parent is the state whose children are currently being evaluated
+        """
+        parent = state.parent
+        if parent is None or not isinstance(state, h_state.HospitalState):
+            return self.compute_matching(state)
+        if parent is not self.parent:
+            self.parent = parent
+            self.parent_matching = self.compute_matching(parent)
+        if self.parent_matching is None:
+            return self.compute_matching(state)
+        box_slots, letter_boxes, letter_unsolved_boxes, letter_costs, total_cost = self.parent_matching
+
+        # Find the new cells of the boxes moved since the parent, which are all at positions given by moved_positions
+        moved_boxes = None
+        if parent.box_positions != state.box_positions:
+            occupancy = state.occupancy
+            for position in state.moved_positions(parent):
+                idx = occupancy.get(position)
+                if idx is not None and idx < 0:
+                    slot = box_slots.get(~idx)
+                    if slot is not None:
+                        if moved_boxes is None:
+                            moved_boxes = []
+                        moved_boxes.append((slot, self.level.cell_index(position)))
+        if moved_boxes is None:
+            return self.parent_matching
+
+        # Only the letters of the moved boxes are matched again
+        letter_boxes = letter_boxes.copy()
+        letter_unsolved_boxes = letter_unsolved_boxes.copy()
+        letter_costs = letter_costs.copy()
+        changed_letters = set()
+        for ((letter, index), cell) in moved_boxes:
+            if letter not in changed_letters:
+                changed_letters.add(letter)
+                letter_boxes[letter] = list(letter_boxes[letter])
+            letter_boxes[letter][index] = cell
+        for letter in changed_letters:
+            boxes = letter_boxes[letter]
+            cost = self.remembered_matching_cost(letter, boxes)
+            if cost >= APPROX_INFINITY:
+                return None
+            total_cost += cost - letter_costs[letter]
+            letter_costs[letter] = cost
+            goal_cells = self.goal_cells[letter]
+            letter_unsolved_boxes[letter] = [box for box in boxes if box not in goal_cells]
+        return box_slots, letter_boxes, letter_unsolved_boxes, letter_costs, total_cost
+
+    def compute_matching(self, state: h_state.HospitalState):
+        """
+        Computes the matching of the state from scratch as a (box slots, boxes, unsolved boxes, matching costs, total
+        matching cost) tuple. The box slots map the index of every box with goals into its letter and its index in the
+        boxes of the letter, which stays the same in the states resulting from the state, since boxes keep their index.
+        The boxes, unsolved boxes and matching costs map each letter with goals into the cell indices of its boxes, the
+        cell indices of its boxes which are not on a goal of the letter and its matching cost. Returns None if the
+        boxes of some letter cannot be matched with finite cost.
+        """
+        level = self.level
+        letter_boxes = {letter: [] for letter in self.goal_distances}
+        box_slots = {}
+        for (box_index, (box_position, box_char)) in enumerate(state.box_positions):
+            boxes = letter_boxes.get(box_char)
+            if boxes is not None:
+                box_slots[box_index] = (box_char, len(boxes))
+                boxes.append(level.cell_index(box_position))
+
+        letter_unsolved_boxes = {}
+        letter_costs = {}
+        total_cost = 0
+        for (letter, boxes) in letter_boxes.items():
+            cost = self.remembered_matching_cost(letter, boxes)
+            if cost >= APPROX_INFINITY:
+                return None
+            letter_costs[letter] = cost
+            total_cost += cost
+            goal_cells = self.goal_cells[letter]
+            letter_unsolved_boxes[letter] = [box for box in boxes if box not in goal_cells]
+        return box_slots, letter_boxes, letter_unsolved_boxes, letter_costs, total_cost
+
+    def remembered_matching_cost(self, letter: str, boxes: list[int]) -> int:
+        """Returns the matching cost of the boxes of the letter, which is only computed if it is not remembered"""
+        key = (letter, tuple(boxes))
+        cost = self.matching_costs.get(key)
+        if cost is None:
+            cost = self.matching_cost(letter, boxes)
+            if len(self.matching_costs) >= self.MAX_MATCHING_COSTS:
+                self.matching_costs.clear()
+            self.matching_costs[key] = cost
+        return cost
+
+    def matching_cost(self, letter: str, boxes: list[int]) -> int:
+        """
+        Returns the minimal sum of distances when matching every goal of the letter with a distinct box, where boxes
+        are given by their cell indices, or APPROX_INFINITY if no matching with finite distances exists
+        """
+        goal_distances = self.goal_distances[letter]
+        if len(boxes) < len(goal_distances):
+            return APPROX_INFINITY
+        costs = [[APPROX_INFINITY if distances[box] == h_distances.UNREACHABLE else distances[box] for box in boxes]
+                 for distances in goal_distances]
+        if len(costs) == 1:
+            cost = min(costs[0])
+        else:
+            cost = min_cost_assignment(costs)
+        return min(cost, APPROX_INFINITY)
+
+
+class HospitalPatternDatabaseHeuristics(HospitalMatchingHeuristics):
+    """
+    The pattern database heuristic extends the matching heuristic by also looking up the boxes of each letter in a
+    pattern database (see pattern_database.py), which accounts for boxes blocking each other's way to the goals,
+    and using the larger of the two estimates of the number of box moves. Box configurations which the pattern
+    database shows can never be solved get an infinite estimate.
+    The pattern databases are built during preprocessing unless they are found in the level cache (see --cache-dir),
+    so for large levels they should be built in advance with build_pdb.py.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.pattern_databases = {}
+        self.active_pattern_databases = {}
+
+    def preprocess(self, level: h_level.HospitalLevel):
+        super().preprocess(level)
+        self.pattern_databases = h_pattern_database.load_pattern_databases(level)
+
+    def prepare(self, goal_description: h_goal_description.HospitalGoalDescription):
+        super().prepare(goal_description)
+        # The pattern databases can only be used for letters where the goal description has the goals of the level
+        self.active_pattern_databases = {}
+        for (letter, pattern_database) in self.pattern_databases.items():
+            if self.goal_cells.get(letter) == set(pattern_database.goal_cells):
+                self.active_pattern_databases[letter] = pattern_database
+
+    def matching_cost(self, letter: str, boxes: list[int]) -> int:
+        cost = super().matching_cost(letter, boxes)
+        pattern_database = self.active_pattern_databases.get(letter)
+        if pattern_database is None or cost >= APPROX_INFINITY:
+            return cost
+        pattern_cost = pattern_database.cost(boxes)
+        if pattern_cost == h_distances.UNREACHABLE:
+            return APPROX_INFINITY
+        return max(cost, pattern_cost)
+
+
+def min_cost_assignment(costs: list[list[int]]) -> int:
+    """
+    Returns the minimal total cost of assigning every row of the cost matrix to a distinct column using the Hungarian
+    algorithm, which runs in O(rows^2 * columns) time. The matrix must have at least as many columns as rows.
+    """
+    num_rows = len(costs)
+    num_cols = len(costs[0])
+    infinity = float('inf')
+    # Potentials of the rows and columns, and the row assigned to each column (0 means unassigned), all 1-indexed
+    row_potentials = [0] * (num_rows + 1)
+    col_potentials = [0] * (num_cols + 1)
+    assigned_rows = [0] * (num_cols + 1)
+    previous_cols = [0] * (num_cols + 1)
+    for row in range(1, num_rows + 1):
+        # Find a shortest augmenting path from the new row to an unassigned column
+        assigned_rows[0] = row
+        col = 0
+        min_slack = [infinity] * (num_cols + 1)
+        used = [False] * (num_cols + 1)
+        while assigned_rows[col] != 0:
+            used[col] = True
+            current_row = assigned_rows[col]
+            current_costs = costs[current_row - 1]
+            current_potential = row_potentials[current_row]
+            delta = infinity
+            next_col = 0
+            for other_col in range(1, num_cols + 1):
+                if not used[other_col]:
+                    slack = current_costs[other_col - 1] - current_potential - col_potentials[other_col]
+                    if slack < min_slack[other_col]:
+                        min_slack[other_col] = slack
+                        previous_cols[other_col] = col
+                    if min_slack[other_col] < delta:
+                        delta = min_slack[other_col]
+                        next_col = other_col
+            for other_col in range(num_cols + 1):
+                if used[other_col]:
+                    row_potentials[assigned_rows[other_col]] += delta
+                    col_potentials[other_col] -= delta
+                else:
+                    min_slack[other_col] -= delta
+            col = next_col
+        # Flip the assignments along the augmenting path
+        while col != 0:
+            previous_col = previous_cols[col]
+            assigned_rows[col] = assigned_rows[previous_col]
+            col = previous_col
+    return sum(costs[assigned_rows[col] - 1][col - 1] for col in range(1, num_cols + 1) if assigned_rows[col] != 0)
@@ -11,25 +11,52 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import random
+import re
 import sys
+from array import array
+
+import domains.hospital.distances as h_distances
+import domains.hospital.level_cache as h_level_cache
+
+
+# Translates the characters of a level into 1 for walls and 0 for everything else
+WALL_TRANSLATION = bytes(1 if byte == ord('+') else 0 for byte in range(256))
+OBJECT_PATTERN = re.compile(r'[0-9A-Z]')
 
 
 class HospitalLevel:
     """
     The Level class stores all information loaded from the level file in a convenient format.
-    - Walls are stored as a two-dimensional row-major array of booleans, i.e. walls[row][col] is True iff
-      there is a wall at (row, col)
+    - Walls are stored compactly in wall_grid, a bytearray with one byte per cell in the flattened level grid (see
+      cell_index below) which is 1 iff there is a wall in the cell. The walls are also available as a two-dimensional
+      row-major array of booleans, i.e. walls[row][col] is True iff there is a wall at (row, col), which is created the
+      first time it is used. The level can be constructed from either.
     - Colors is a map from characters into a color string. I.e. if box A is red then colors['A'] = "red".
       Note that this map stores the colors of both agents and boxes
     - agent_goals and box_goals are lists of goals in the format (position, char, is_positive).
       See goal_description.py for further detail
     - initial_agent_positions and initial_box_positions are lists of the initial positions of agents and boxes in
       the format (position, character).
+    - Positions can also be referred to by their cell index in the flattened (row-major) level grid, i.e.
+      cell_index((row, col)) == row * num_cols + col. This allows positions to be stored as a single small integer.
+    - zobrist_keys is a map from characters into a list of random 64-bit keys, one per cell. The Zobrist hash of a
+      state is the XOR of the keys of all its objects, i.e. zobrist_keys[char][cell_index(position)], which allows
+      the hash to be updated incrementally when objects move.
+    - distances is the distance oracle of the level, which lazily computes and stores the true shortest path
+      distances between cells (see distances.py), e.g. distances.distance(position, goal_position).
+    - cache is the on-disk cache of derived artifacts of the level (see level_cache.py), or None if caching has not
+      been enabled using attach_cache.
+    - can_push and can_pull tell whether the action library allows agents to push and pull boxes, which determines
+      where boxes can get stuck (see dead_cells and HospitalState.is_deadlocked). Both default to True, which is
+      always safe, but makes fewer cells dead.
     """
 
     def __init__(self, name, walls, colors, agent_goals, box_goals, initial_agent_positions, initial_box_positions):
         self.name = name
-        self.walls = walls
+        # The rows of walls may be lists of booleans or rows of a wall grid
+        self.wall_grid = bytearray(b''.join(bytes(row) for row in walls))
+        self._walls = None
         self.colors = colors
         self.agent_goals = agent_goals
         self.box_goals = box_goals
@@ -41,6 +68,35 @@ class HospitalLevel:
         self.num_boxes = len(self.initial_box_positions)
         self.num_agent_goals = len(self.agent_goals)
         self.num_box_goals = len(self.box_goals)
+        self.num_rows = len(walls)
+        self.num_cols = len(walls[0]) if self.num_rows > 0 else 0
+        self.num_cells = self.num_rows * self.num_cols
+
+        # Use a fixed seed such that the Zobrist keys (and thereby the search order) are deterministic across runs.
+        # The keys of a character are drawn as one block of random bytes, which is much faster than one key at a time.
+        zobrist_random = random.Random(0)
+        self.zobrist_keys = {char: array('Q', zobrist_random.randbytes(8 * self.num_cells)).tolist()
+                             for char in sorted(self.colors)}
+
+        self.distances = h_distances.HospitalDistanceOracle(self)
+        self.cache = None
+
+        self.can_push = True
+        self.can_pull = True
+        # Maps (letter, can_push, can_pull) into the dead cells computed by dead_cells
+        self.dead_cell_maps = {}
+        self.box_goals_at = {position: char for (position, char, is_positive) in self.box_goals if is_positive}
+        # Boxes whose color has no agents can never move
+        agent_colors = {self.colors[char] for (_, char) in self.initial_agent_positions}
+        self.movable_letters = {char for (_, char) in self.initial_box_positions if self.colors[char] in agent_colors}
+        # The letters where every box must end on a goal, i.e. where there are as many boxes as goals
+        num_boxes = {}
+        for (_, char) in self.initial_box_positions:
+            num_boxes[char] = num_boxes.get(char, 0) + 1
+        num_goals = {}
+        for char in self.box_goals_at.values():
+            num_goals[char] = num_goals.get(char, 0) + 1
+        self.goal_letters = {char for char in num_goals if num_boxes.get(char, 0) == num_goals[char]}
 
     @staticmethod
     def parse_level_lines(level_lines):
@@ -77,31 +133,32 @@ class HospitalLevel:
         num_rows = 0
         num_cols = 0
 
-        # Skip first line since that is just '#initial'
-        for line in level_lines[1:]:
+        # The '#initial' line has already been read by the loop above
+        for line in reversed(level_lines):
             if line.startswith("#"):
                 # Found start of next section
                 break
             num_rows += 1
             num_cols = max(num_cols, len(line))
 
-        # Read initial state
+        # Read initial state. Instead of looking at one character at a time, the rows are padded with walls and joined
+        # into a single string, such that the wall grid can be computed by a single translation of the string and the
+        # objects can be found using a regular expression, where the offset of an object is its cell index.
+        initial_rows = ''.join(level_lines.pop().ljust(num_cols, '+') for _ in range(num_rows))
+        wall_grid = initial_rows.encode('ascii', 'replace').translate(WALL_TRANSLATION)
+        walls = [wall_grid[row * num_cols:(row + 1) * num_cols] for row in range(num_rows)]
+
         initial_agent_positions = [((0, 0), '')] * 10
         initial_box_positions = []
-        walls = [[True for _ in range(num_cols)] for _ in range(num_rows)]
-
         num_agents = 0
-        for row in range(num_rows):
-            line = level_lines.pop()
-            for col, char in enumerate(line):
-
-                walls[row][col] = char == '+'
-                if '0' <= char <= '9':
-                    idx = ord(char) - ord('0')
-                    initial_agent_positions[idx] = ((row, col), char)
-                    num_agents += 1
-                elif 'A' <= char <= 'Z':
-                    initial_box_positions.append(((row, col), char))
+        for match in OBJECT_PATTERN.finditer(initial_rows):
+            char = match.group()
+            position = divmod(match.start(), num_cols)
+            if char <= '9':
+                initial_agent_positions[ord(char) - ord('0')] = (position, char)
+                num_agents += 1
+            else:
+                initial_box_positions.append((position, char))
 
         # Cut off agents not used in level
         initial_agent_positions = initial_agent_positions[:num_agents]
@@ -112,20 +169,115 @@ class HospitalLevel:
 
         level_lines.pop()  # Skip line since that is just '#goal'
 
-        for row in range(num_rows):
-            line = level_lines.pop()
-            for col, char in enumerate(line):
-
-                if '0' <= char <= '9':
-                    agent_goals.append(((row, col), char, True))
-                if 'A' <= char <= 'Z':
-                    box_goals.append(((row, col), char, True))
+        goal_rows = ''.join(level_lines.pop().ljust(num_cols, '+') for _ in range(num_rows))
+        for match in OBJECT_PATTERN.finditer(goal_rows):
+            char = match.group()
+            goal = (divmod(match.start(), num_cols), char, True)
+            if char <= '9':
+                agent_goals.append(goal)
+            else:
+                box_goals.append(goal)
 
         return HospitalLevel(level_name, walls, colors, agent_goals, box_goals, initial_agent_positions, initial_box_positions)
 
+    def content_hash(self):
+        """
+        Returns a hash of everything parsed from the level file except the level name, such that levels with the same
+        hash have identical derived artifacts
+        """
+        content = repr((self.num_cols, bytes(self.wall_grid), sorted(self.colors.items()), self.agent_goals, self.box_goals,
+                        self.initial_agent_positions, self.initial_box_positions))
+        # Hashing is only needed when the level cache is enabled, so hashlib is not imported at startup
+        import hashlib
+        return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+    def attach_cache(self, cache_directory):
+        """Enables the on-disk cache of derived artifacts and loads the artifacts already cached for this level"""
+        self.cache = h_level_cache.HospitalLevelCache(cache_directory, self.content_hash())
+        self.distances.load_cached_tables(self.cache)
+
+    def store_cache(self):
+        """Stores the artifacts derived so far in the on-disk cache, if it is enabled"""
+        if self.cache is not None:
+            self.distances.store_cached_tables(self.cache)
+
+    def dead_cells(self, letter):
+        """
+        Returns the dead cells of the given box letter as a sequence of flags indexed by cell index, where a cell is
+        dead if a box of that letter can never be moved from the cell onto a goal of the letter, not even when all
+        other boxes and agents are ignored. A box in a dead cell therefore means that the level cannot be solved.
+        Only letters in goal_letters have dead cells, since the boxes of other letters do not all need to reach a goal.
+        The dead cells are computed the first time they are requested and are stored in the level cache if enabled.
+        """
+        key = (letter, self.can_push, self.can_pull)
+        dead_cells = self.dead_cell_maps.get(key)
+        if dead_cells is None:
+            name = f"dead_cells_{letter}_{int(self.can_push)}{int(self.can_pull)}"
+            dead_cells = self.cache.load(name) if self.cache is not None else None
+            if dead_cells is None or len(dead_cells) != self.num_cells:
+                dead_cells = self.compute_dead_cells(letter)
+                if self.cache is not None:
+                    self.cache.store(name, [dead_cells])
+            self.dead_cell_maps[key] = dead_cells
+        return dead_cells
+
+    def compute_dead_cells(self, letter):
+        dead_cells = bytearray(self.num_cells)
+        if letter not in self.goal_letters:
+            return dead_cells
+
+        def is_free(row, col):
+            return 0 <= row < self.num_rows and 0 <= col < self.num_cols and \
+                not self.wall_grid[row * self.num_cols + col]
+
+        # Search backwards from the goals for the cells from which a box can be moved to a goal. A box can be moved
+        # from one cell to a free neighbouring cell if an agent can push it, i.e. enter its cell from any other free
+        # neighbour, or pull it, i.e. stand at the destination and leave it towards any other free neighbour.
+        dead_cells[:] = b'\x01' * self.num_cells
+        queue = []
+        for (position, char) in self.box_goals_at.items():
+            if char == letter:
+                dead_cells[self.cell_index(position)] = 0
+                queue.append(position)
+        directions = ((-1, 0), (1, 0), (0, -1), (0, 1))
+        while queue:
+            row, col = queue.pop()
+            for (d_row, d_col) in directions:
+                previous_row, previous_col = row - d_row, col - d_col
+                cell = previous_row * self.num_cols + previous_col
+                if not is_free(previous_row, previous_col) or not dead_cells[cell]:
+                    continue
+                can_push = self.can_push and any(is_free(previous_row + n_row, previous_col + n_col)
+                                                 for (n_row, n_col) in directions if (n_row, n_col) != (d_row, d_col))
+                can_pull = self.can_pull and any(is_free(row + n_row, col + n_col)
+                                                 for (n_row, n_col) in directions if (n_row, n_col) != (-d_row, -d_col))
+                if can_push or can_pull:
+                    dead_cells[cell] = 0
+                    queue.append((previous_row, previous_col))
+        return dead_cells
+
+    @property
+    def walls(self):
+        if self._walls is None:
+            self._walls = [[wall == 1 for wall in self.wall_grid[row * self.num_cols:(row + 1) * self.num_cols]]
+                           for row in range(self.num_rows)]
+        return self._walls
+
     def wall_at(self, position):
         """Returns True if there is a wall at the requested position and False otherwise"""
-        return self.walls[position[0]][position[1]]
+        return self.wall_grid[position[0] * self.num_cols + position[1]] == 1
+
+    def cell_index(self, position):
+        """Returns the index of the position in the flattened level grid"""
+        return position[0] * self.num_cols + position[1]
+
+    def cell_position(self, index):
+        """Returns the position corresponding to an index in the flattened level grid"""
+        return divmod(index, self.num_cols)
+
+    def zobrist_key(self, position, char):
+        """Returns the Zobrist key of an object with the given character at the requested position"""
+        return self.zobrist_keys[char][position[0] * self.num_cols + position[1]]
 
     def agent_goal_at(self, position):
         """If there is an agent goal at the requested position, its letter is returned and None otherwise"""
@@ -0,0 +1,67 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import mmap
+import os
+
+
+class HospitalLevelCache:
+    """
+    The level cache stores artifacts derived from a level, such as distance tables, on disk such that they only need
+    to be computed the first time the searchclient is run on the level.
+    Each level has its own sub directory of the cache directory named by the content hash of the parsed level
+    (see HospitalLevel.content_hash), so changing a level file automatically invalidates its cached artifacts.
+    Artifacts are stored as raw arrays of a fixed type (using the type codes of the 'array' module) and are loaded
+    back as memory-mapped read-only memoryviews, which means that loading is nearly instant and that only the parts
+    actually used are read from disk.
+    """
+
+    def __init__(self, cache_directory: str, content_hash: str):
+        self.directory = os.path.join(cache_directory, content_hash)
+
+    def load(self, name: str, typecode: str = 'B'):
+        """
+        Returns a memory-mapped memoryview of the artifact with the given name, or None if it is not cached.
+        Artifacts consisting of several arrays of different types can be loaded as bytes (the default typecode 'B')
+        and split using memoryview slicing and casting.
+        """
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return memoryview(b'').cast(typecode)
+                # The memory map stays valid after the file is closed
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+        return memoryview(mapping).cast(typecode)
+
+    def store(self, name: str, buffers: list):
+        """
+        Stores the concatenation of the buffers (e.g. arrays or memoryviews) as the artifact with the given name.
+        The artifact is written to a temporary file which then replaces the old artifact, such that concurrent runs
+        never see partially written artifacts.
+        """
+        # tempfile is only imported when needed, since most runs do not use the level cache
+        import tempfile
+
+        os.makedirs(self.directory, exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, prefix=f".{name}.")
+        try:
+            with os.fdopen(file_descriptor, 'wb') as f:
+                for buffer in buffers:
+                    f.write(buffer)
+            os.replace(temporary_path, os.path.join(self.directory, name))
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
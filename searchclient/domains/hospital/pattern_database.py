@@ -0,0 +1,204 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import itertools
+import math
+import sys
+import time
+from array import array
+from collections import deque
+
+import domains.hospital.actions as actions
+import domains.hospital.level as h_level
+from domains.hospital.distances import UNREACHABLE
+
+# The number of boxes in the largest patterns. The tables for patterns of k boxes have one entry per k-subset of the
+# free cells, i.e. about num_free_cells^k / k! entries, which limits the pattern size to small numbers in practice.
+PATTERN_SIZE = 2
+# Tables with more entries than this are not built, in which case only the smaller patterns are used
+MAX_TABLE_SIZE = 1 << 22
+
+
+class HospitalPatternDatabase:
+    """
+    A pattern database stores, for a single box letter, the exact number of box moves needed to bring a small subset
+    of boxes onto distinct goals of that letter, where all other boxes are ignored and where the agent is assumed to
+    be able to reach any side of a box. A box can move to a neighbouring free cell if there is room for an agent to
+    push it, i.e. enter its cell from another side, or to pull it, i.e. leave the destination towards another side.
+    This is a relaxation of the real problem, so the stored values are lower bounds on the number of box moves.
+
+    The database consists of one table per pattern size k = 1..pattern_size, containing an entry for every set of k
+    free cells, where the free cells are the cells reachable from the goals. Sets of cells are indexed by the
+    combinatorial number system, i.e. the sorted free cell indices c_1 < ... < c_k are stored at index
+    C(c_1, 1) + ... + C(c_k, k). Boxes are interchangeable, so the order of the boxes does not matter. The tables are
+    computed by a breadth-first search backwards from the goal configurations and entries from which the goals cannot
+    be reached contain UNREACHABLE.
+
+    Since the tables only depend on the walls and the goals, they can be stored in the level cache, e.g. using the
+    offline build_pdb.py script, and are then memory-mapped when the searchclient starts.
+    """
+
+    def __init__(self, level: h_level.HospitalLevel, letter: str, goal_positions: list[tuple[int, int]]):
+        self.level = level
+        self.letter = letter
+        self.goal_cells = sorted(level.cell_index(goal_position) for goal_position in goal_positions)
+        # Number the free cells, where free_cells[i] is the cell index of free cell i and free_index the inverse
+        goal_distances = level.distances.distances_from(goal_positions[0])
+        self.free_cells = [cell for cell in range(level.num_cells) if goal_distances[cell] != UNREACHABLE]
+        self.free_index = array('i', [-1]) * level.num_cells
+        for (i, cell) in enumerate(self.free_cells):
+            self.free_index[cell] = i
+        self.pattern_size = 1
+        while self.pattern_size < min(PATTERN_SIZE, len(self.goal_cells)) and \
+                self.table_size(self.pattern_size + 1) <= MAX_TABLE_SIZE:
+            self.pattern_size += 1
+        # tables[k] is the table for patterns of k boxes
+        self.tables = [None] * (self.pattern_size + 1)
+
+    def artifact_name(self, k: int) -> str:
+        return f"pdb_{self.letter}_{k}"
+
+    def table_size(self, k: int) -> int:
+        return math.comb(len(self.free_cells), k)
+
+    def load(self, cache) -> bool:
+        """Loads the tables from the level cache, returning whether all tables were cached"""
+        for k in range(1, self.pattern_size + 1):
+            table = cache.load(self.artifact_name(k), 'H')
+            if table is None or len(table) != self.table_size(k):
+                return False
+            self.tables[k] = table
+        return True
+
+    def store(self, cache):
+        for k in range(1, self.pattern_size + 1):
+            cache.store(self.artifact_name(k), [self.tables[k]])
+
+    def build(self):
+        for k in range(1, self.pattern_size + 1):
+            start_time = time.time()
+            self.tables[k] = self.build_table(k)
+            print(f"Built pattern database for {k} box(es) of letter {self.letter} with {self.table_size(k)} entries "
+                  f"in {time.time() - start_time:.3f} s", file=sys.stderr, flush=True)
+
+    def pattern_index(self, free_indices) -> int:
+        """Returns the index of a set of free cells, given as a sorted sequence of free cell indices"""
+        index = 0
+        for (i, free_index) in enumerate(free_indices):
+            index += math.comb(free_index, i + 1)
+        return index
+
+    def build_table(self, k: int) -> array:
+        table = array('H', [UNREACHABLE]) * self.table_size(k)
+        num_cols = self.level.num_cols
+        free_index = self.free_index
+        deltas = [delta[0] * num_cols + delta[1] for delta in actions.direction_deltas.values()]
+
+        queue = deque()
+        for goal_cells in itertools.combinations(self.goal_cells, k):
+            pattern = tuple(sorted(free_index[cell] for cell in goal_cells))
+            table[self.pattern_index(pattern)] = 0
+            queue.append(pattern)
+
+        # Levels are enclosed by walls, so the neighbours of the cells reachable from the goals are always in bounds
+        while queue:
+            pattern = queue.popleft()
+            next_distance = table[self.pattern_index(pattern)] + 1
+            occupied = {self.free_cells[i] for i in pattern}
+            for box in occupied:
+                for delta in deltas:
+                    # Look for a configuration where the box was at 'previous' and moved by delta to its current cell
+                    previous = box - delta
+                    if free_index[previous] < 0 or previous in occupied:
+                        continue
+                    # It was pushed by an agent entering its cell from another side or pulled by an agent leaving
+                    # the destination towards another side
+                    if not (any(free_index[previous + other] >= 0 and previous + other not in occupied
+                                for other in deltas if other != delta) or
+                            any(free_index[box + other] >= 0 and box + other not in occupied
+                                for other in deltas if other != -delta)):
+                        continue
+                    previous_pattern = tuple(sorted(free_index[previous if cell == box else cell] for cell in occupied))
+                    index = self.pattern_index(previous_pattern)
+                    if table[index] == UNREACHABLE:
+                        table[index] = next_distance
+                        queue.append(previous_pattern)
+        return table
+
+    def cost(self, box_cells: list[int]) -> int:
+        """
+        Returns a lower bound on the number of box moves needed to bring the boxes (given by their cell indices) onto
+        the goals, or UNREACHABLE if some boxes can never reach the goals. The boxes are greedily partitioned into
+        pairs, picking the pairs whose moves interact the most first, and the values of the pairs and remaining
+        single boxes are added.
+        """
+        free_index = self.free_index
+        boxes = [free_index[cell] for cell in box_cells]
+        if min(boxes, default=0) < 0:
+            # Some box is in a part of the level which is not connected to the goals
+            return UNREACHABLE
+        single_table = self.tables[1]
+        singles = [single_table[box] for box in boxes]
+        if UNREACHABLE in singles:
+            return UNREACHABLE
+        total = sum(singles)
+        if self.pattern_size < 2:
+            return total
+
+        pair_table = self.tables[2]
+        gains = []
+        for (i, j) in itertools.combinations(range(len(boxes)), 2):
+            low, high = (boxes[i], boxes[j]) if boxes[i] < boxes[j] else (boxes[j], boxes[i])
+            value = pair_table[low + high * (high - 1) // 2]
+            if value == UNREACHABLE:
+                return UNREACHABLE
+            gain = value - singles[i] - singles[j]
+            if gain > 0:
+                gains.append((gain, i, j))
+        gains.sort(reverse=True)
+        paired = set()
+        for (gain, i, j) in gains:
+            if i not in paired and j not in paired:
+                total += gain
+                paired.add(i)
+                paired.add(j)
+        return total
+
+
+def load_pattern_databases(level: h_level.HospitalLevel, build: bool = True) -> dict[str, HospitalPatternDatabase]:
+    """
+    Returns the pattern databases of every box letter with as many boxes as goals, since the goals of the other
+    letters do not tell where the boxes must end up. The databases are loaded from the level cache if possible, and
+    are otherwise built (unless build is False) and stored in the cache if it is enabled.
+    """
+    goal_positions = {}
+    for (goal_position, goal_char, is_positive_literal) in level.box_goals:
+        if is_positive_literal:
+            goal_positions.setdefault(goal_char, []).append(goal_position)
+    num_boxes = {}
+    for (_, box_char) in level.initial_box_positions:
+        num_boxes[box_char] = num_boxes.get(box_char, 0) + 1
+
+    pattern_databases = {}
+    for (letter, positions) in sorted(goal_positions.items()):
+        if num_boxes.get(letter, 0) != len(positions):
+            continue
+        pattern_database = HospitalPatternDatabase(level, letter, positions)
+        if level.cache is None or not pattern_database.load(level.cache):
+            if not build:
+                continue
+            pattern_database.build()
+            if level.cache is not None:
+                pattern_database.store(level.cache)
+        pattern_databases[letter] = pattern_database
+    return pattern_databases
@@ -15,10 +15,12 @@ from __future__ import annotations
 import copy
 import itertools
 import random
+from array import array
 # Set fixed seed for random shuffle (ensures deterministic runs)
 random.seed(a=0, version=2)
 
 import domains.hospital.level as h_level
+import domains.hospital.goal_description as h_goal_description
 import domains.hospital.actions as actions
 
 
@@ -30,17 +32,26 @@ class HospitalState:
     Note that the index of a particular agents and boxes is *not* necessarily fixed across states.
     The *static* information is instead stored in the HospitalLevel class in the level.py file.
     This separation greatly reduces the memory usage since we only store static information once.
+    In order to make agent_at, box_at, object_at and free_at constant time operations, each state also keeps an
+    occupancy map from positions to the object at that position: an agent with index i is stored as i, while a box
+    with index i is stored as ~i (i.e. -i - 1). The occupancy map is built once for states constructed directly and
+    is afterwards updated incrementally by 'result', so the position lists should only be modified by actions.
+    Likewise, the Zobrist hash of the state (see HospitalLevel.zobrist_keys) is computed once and then updated by
+    'result' by XOR'ing in and out the keys of the moved objects only.
+    Finally, once a state has been tested against a goal description, it stores its number of unsatisfied goals
+    together with the goal description in 'goal_count', from which the counts of its children are computed by only
+    looking at the objects which moved.
     """
 
-    level = None
-
     def __init__(
         self,
         level: h_level.HospitalLevel,
         agent_positions: list[tuple[tuple[int, int], str]],
         box_positions: list[tuple[tuple[int, int], str]],
         parent = None,
-        action: actions.AnyAction = None
+        action: actions.AnyAction = None,
+        occupancy: dict[tuple[int, int], int] = None,
+        zobrist_hash: int = None
     ):
         self.level = level
         self.agent_positions = agent_positions
@@ -49,48 +60,174 @@ class HospitalState:
         self.action = action
         self.path_cost = 0 if parent is None else parent.path_cost + 1
 
+        if occupancy is None:
+            occupancy = {}
+            for (agent_index, (agent_position, agent_char)) in enumerate(agent_positions):
+                if agent_char != '':
+                    occupancy[agent_position] = agent_index
+            for (box_index, (box_position, box_char)) in enumerate(box_positions):
+                if box_char != '':
+                    occupancy[box_position] = ~box_index
+        self.occupancy = occupancy
+
+        if zobrist_hash is None:
+            zobrist_hash = 0
+            for (position, char) in itertools.chain(agent_positions, box_positions):
+                if char != '':
+                    zobrist_hash ^= level.zobrist_key(position, char)
+        self.zobrist_hash = zobrist_hash
+
+        # A (goal description, number of unsatisfied goals) pair, see count_unsatisfied_goals
+        self.goal_count = None
+
     def agent_at(self, position: tuple[int, int]) -> tuple[int, str]:
         """
         Returns the index and character of the agent at the given position.
         If there is no agent at the position, -1,'' is returned instead.
         """
-        for (idx, (agent_position, agent_char)) in enumerate(self.agent_positions):
-            if agent_char == '':
-                continue
-            if agent_position == position:
-                return idx, agent_char
-        return -1, ''
+        idx = self.occupancy.get(position, -1)
+        if idx < 0:
+            return -1, ''
+        return idx, self.agent_positions[idx][1]
 
     def box_at(self, position: tuple[int, int]) -> tuple[int, str]:
         """
         Returns the index and character of the box at the given position.
         If there is no box at the position, -1,'' is returned instead.
         """
-        for (idx, (box_position, box_char)) in enumerate(self.box_positions):
-            if box_char == '':
-                continue
-            if box_position == position:
-                return idx, box_char
-        return -1, ''
+        idx = ~self.occupancy.get(position, 0)
+        if idx < 0:
+            return -1, ''
+        return idx, self.box_positions[idx][1]
 
     def object_at(self, position: tuple[int, int]) -> str:
         """
-        Returns the index and character of the object at the given position.
+        Returns the character of the object at the given position.
         It can be used for checks where we do not care whether it is an agent or a box, e.g. when checking
-        for obstacles. If there is no object at the position, -1,'' is returned instead.
+        for obstacles. If there is no object at the position, '' is returned instead.
         """
-        idx, agent_char = self.agent_at(position)
-        if agent_char != '':
-            return agent_char
+        idx = self.occupancy.get(position)
+        if idx is None:
+            return ''
+        elif idx >= 0:
+            return self.agent_positions[idx][1]
         else:
-            idx, box_char = self.box_at(position)
-            return box_char
+            return self.box_positions[~idx][1]
 
     def free_at(self, position: tuple[int, int]) -> bool:
         """Returns True iff there are no objects at the requested location"""
-        return not self.level.wall_at(position) and \
-               self.agent_at(position)[1] == '' and \
-               self.box_at(position)[1] == ''
+        return not self.level.wall_at(position) and position not in self.occupancy
+
+    def count_unsatisfied_goals(self, goal_description: h_goal_description.HospitalGoalDescription) -> int:
+        """
+        Returns the number of goals in the goal description which are not satisfied in this state.
+        If the parent state already knows its count for the goal description, only the goals at the positions of the
+        objects moved by the last joint action are checked. Otherwise, the count is computed from scratch.
+        The count is stored in the state, so it is also useful as a goal count heuristic.
+        """
+        goal_count = self.goal_count
+        if goal_count is not None and goal_count[0] is goal_description:
+            return goal_count[1]
+        parent_goal_count = self.parent.goal_count if self.parent is not None else None
+        if parent_goal_count is not None and parent_goal_count[0] is goal_description:
+            unsatisfied_goals = parent_goal_count[1] + goal_description.count_unsatisfied_goals_change(
+                self.parent, self, self.moved_positions(self.parent))
+        else:
+            unsatisfied_goals = goal_description.count_unsatisfied_goals(self)
+        self.goal_count = (goal_description, unsatisfied_goals)
+        return unsatisfied_goals
+
+    def moved_positions(self, other) -> set[tuple[int, int]]:
+        """
+        Returns the old and new positions of all objects which have moved between the other state and this state,
+        where the other state must be an ancestor of this state
+        """
+        # Comparing the lists first lets us skip the loops in the common case where no agent or no box was moved
+        positions = set()
+        if other.agent_positions != self.agent_positions:
+            for (old_entry, new_entry) in zip(other.agent_positions, self.agent_positions):
+                if old_entry != new_entry:
+                    positions.add(old_entry[0])
+                    positions.add(new_entry[0])
+        if other.box_positions != self.box_positions:
+            for (old_entry, new_entry) in zip(other.box_positions, self.box_positions):
+                if old_entry != new_entry:
+                    positions.add(old_entry[0])
+                    positions.add(new_entry[0])
+        return positions
+
+    def is_deadlocked(self) -> bool:
+        """
+        Returns True if the state provably cannot lead to a solution of the level because a box which must end on a
+        goal (see HospitalLevel.goal_letters) is either in a dead cell (see HospitalLevel.dead_cells) or frozen away
+        from its goals. A box is frozen if it cannot be moved in any direction, and will never be movable again,
+        because it is blocked by walls, immovable boxes, dead cells or other frozen boxes.
+        Only the boxes moved since the parent state are checked, since a box can only become frozen when it moves
+        next to a wall or another box.
+        """
+        level = self.level
+        if self.parent is None:
+            box_positions = [box_position for (box_position, box_char) in self.box_positions if box_char != '']
+        else:
+            box_positions = [position for position in self.moved_positions(self.parent)
+                             if self.occupancy.get(position, 0) < 0]
+
+        for box_position in box_positions:
+            _, box_char = self.box_at(box_position)
+            if box_char not in level.movable_letters:
+                continue
+            if level.dead_cells(box_char)[level.cell_index(box_position)]:
+                return True
+            frozen_boxes = []
+            if self.is_frozen(box_position, set(), frozen_boxes):
+                for (frozen_position, frozen_char) in frozen_boxes:
+                    if frozen_char in level.goal_letters and level.box_goals_at.get(frozen_position) != frozen_char:
+                        return True
+        return False
+
+    def is_frozen(self, box_position: tuple[int, int], assumed_blocked: set, frozen_boxes: list) -> bool:
+        """
+        Returns whether the box at the given position can never move again, assuming that the boxes at the positions
+        in assumed_blocked cannot either. Every box found to be frozen is appended to frozen_boxes.
+        """
+        level = self.level
+        _, box_char = self.box_at(box_position)
+        if box_char not in level.movable_letters:
+            frozen_boxes.append((box_position, box_char))
+            return True
+        dead_cells = level.dead_cells(box_char)
+        # The box itself is assumed to be blocked while checking its neighbours, such that boxes blocking each other
+        # are found to be frozen together
+        assumed_blocked.add(box_position)
+        neighbours_frozen = []
+
+        def is_blocked(position):
+            if level.wall_at(position) or position in assumed_blocked:
+                return True
+            if self.occupancy.get(position, 0) >= 0:
+                return False
+            return self.is_frozen(position, assumed_blocked, neighbours_frozen)
+
+        deltas = actions.direction_deltas.values()
+        for delta in deltas:
+            # The box can move if its destination is free (or can be freed) and not dead, and an agent can either push
+            # it by entering its cell from another side, or pull it by leaving the destination towards another side
+            destination = (box_position[0] + delta[0], box_position[1] + delta[1])
+            if dead_cells[level.cell_index(destination)] or is_blocked(destination):
+                continue
+            if level.can_push and any(not is_blocked((box_position[0] + other[0], box_position[1] + other[1]))
+                                      for other in deltas if other != delta):
+                assumed_blocked.discard(box_position)
+                return False
+            if level.can_pull and any(not is_blocked((destination[0] + other[0], destination[1] + other[1]))
+                                      for other in deltas if other != (-delta[0], -delta[1])):
+                assumed_blocked.discard(box_position)
+                return False
+
+        assumed_blocked.discard(box_position)
+        frozen_boxes.append((box_position, box_char))
+        frozen_boxes.extend(neighbours_frozen)
+        return True
 
     def extract_plan(self) -> list[actions.AnyAction]:
         """Extracts a plan from the search tree by walking backwards through the search tree"""
@@ -130,15 +267,37 @@ class HospitalState:
 
     def result(self, joint_action: list[actions.AnyAction]):
         """Computes the state resulting from applying a joint action to this state"""
-        new_state = HospitalState(self.level, copy.copy(self.agent_positions), copy.copy(self.box_positions),
-                                  self, joint_action)
+        new_state = HospitalState(self.level, self.agent_positions.copy(), self.box_positions.copy(),
+                                  self, joint_action, self.occupancy.copy(), self.zobrist_hash)
 
         for (agent_index, action) in enumerate(joint_action):
             action.result(agent_index, new_state)
 
-        # Sorting the box positions ensures that the boxes are indistinguishable which significantly
-        # reduces the search space size.
-        new_state.box_positions.sort()
+        # Collect the objects moved by the joint action as (old position, new position, character, occupancy value).
+        # Comparing the lists first lets us skip the boxes in the common case where no box was moved.
+        moved_objects = []
+        for (agent_index, (old_entry, new_entry)) in enumerate(zip(self.agent_positions, new_state.agent_positions)):
+            if old_entry is not new_entry and new_entry[1] != '':
+                moved_objects.append((old_entry[0], new_entry[0], new_entry[1], agent_index))
+        if self.box_positions != new_state.box_positions:
+            for (box_index, (old_entry, new_entry)) in enumerate(zip(self.box_positions, new_state.box_positions)):
+                if old_entry is not new_entry and new_entry[1] != '':
+                    moved_objects.append((old_entry[0], new_entry[0], new_entry[1], ~box_index))
+
+        # Update the occupancy map and the hash. All moved objects are removed before any are inserted again, since an
+        # object may move into a cell vacated during the same joint action, e.g. a box pulled into the agent's old cell.
+        occupancy = new_state.occupancy
+        zobrist_keys = self.level.zobrist_keys
+        num_cols = self.level.num_cols
+        zobrist_hash = new_state.zobrist_hash
+        for (old_position, new_position, char, _) in moved_objects:
+            del occupancy[old_position]
+            keys = zobrist_keys[char]
+            zobrist_hash ^= keys[old_position[0] * num_cols + old_position[1]] ^ \
+                            keys[new_position[0] * num_cols + new_position[1]]
+        for (_, new_position, _, idx) in moved_objects:
+            occupancy[new_position] = idx
+        new_state.zobrist_hash = zobrist_hash
 
         return new_state
 
@@ -160,29 +319,71 @@ class HospitalState:
                 return False
         return True
 
-    def get_applicable_actions(self, action_set: list[list[actions.AnyAction]]):
-        """Returns a list of all applicable joint_action in this state"""
+    def iter_applicable_actions(self, action_set: list[list[actions.AnyAction]]):
+        """
+        Lazily yields all applicable joint actions in this state (in the same order as itertools.product would).
+        Instead of generating every combination of individually applicable actions and then filtering out the
+        conflicting ones, actions are assigned agent by agent and a partial joint action is abandoned as soon as it
+        conflicts, such that no joint action extending it is ever generated.
+        """
         num_agents = len(self.agent_positions)
 
-        # Determine all applicable actions for each individual agent, i.e. without consideration of conflicts.
+        # Determine all applicable actions for each individual agent, i.e. without consideration of conflicts,
+        # together with their destinations and moved boxes. Filtered agents never cause any conflicts.
         applicable_actions = [[] for _ in range(num_agents)]
-
         for agent_index in range(num_agents):
+            is_filtered = self.agent_positions[agent_index][1] == ''
             for action in action_set[agent_index]:
                 if action.is_applicable(agent_index, self):
-                    applicable_actions[agent_index].append(action)
+                    destinations, boxes_moved = ([], []) if is_filtered else action.conflicts(agent_index, self)
+                    applicable_actions[agent_index].append((action, destinations, boxes_moved))
 
-        # Determine all applicable joint actions, but checking all combinations of the individual applicable actions
-        # We can skip this step if there only is one agent
-        applicable_joint_actions = []
+        # We can skip the conflict checks if there only is one agent
         if num_agents == 1:
-            for action in applicable_actions[0]:
-                applicable_joint_actions.append([action])
-        else:
-            for joint_action in itertools.product(*applicable_actions):
-                if not self.is_conflicting(joint_action):
-                    applicable_joint_actions.append(joint_action)
+            for (action, _, _) in applicable_actions[0]:
+                yield [action]
+            return
+
+        # Depth-first assignment of actions to agents. choices[i] is the index of the action currently assigned to
+        # agent i, while destinations and active_boxes contain the cells claimed by the agents 0..i
+        choices = [-1] * num_agents
+        destinations = set()
+        active_boxes = set()
+        agent_index = 0
+        while agent_index >= 0:
+            options = applicable_actions[agent_index]
+            choice = choices[agent_index]
+            # Undo the previous choice of this agent before trying the next one
+            if choice >= 0:
+                _, action_destinations, action_boxes = options[choice]
+                destinations.difference_update(action_destinations)
+                active_boxes.difference_update(action_boxes)
+
+            # Find the next action of this agent which does not conflict with the actions of the previous agents
+            choice += 1
+            while choice < len(options):
+                _, action_destinations, action_boxes = options[choice]
+                if destinations.isdisjoint(action_destinations) and active_boxes.isdisjoint(action_boxes):
+                    break
+                choice += 1
+
+            if choice == len(options):
+                # No more options for this agent, so we backtrack to the previous agent
+                choices[agent_index] = -1
+                agent_index -= 1
+                continue
+
+            choices[agent_index] = choice
+            destinations.update(action_destinations)
+            active_boxes.update(action_boxes)
+            if agent_index == num_agents - 1:
+                yield tuple(applicable_actions[i][choices[i]][0] for i in range(num_agents))
+            else:
+                agent_index += 1
 
+    def get_applicable_actions(self, action_set: list[list[actions.AnyAction]]):
+        """Returns a list of all applicable joint_action in this state"""
+        applicable_joint_actions = list(self.iter_applicable_actions(action_set))
         random.shuffle(applicable_joint_actions)
         return applicable_joint_actions
 
@@ -229,9 +430,14 @@ class HospitalState:
         """
         Notice that we here only compare the agent positions and box positions, but ignore all other fields.
         That means that two states with identical positions but e.g. different parent will be seen as equal.
+        The boxes are compared as sets such that boxes with the same letter are indistinguishable, which significantly
+        reduces the search space size. Since states with different hashes can never be equal, the positions are only
+        compared when the hashes collide.
         """
         if isinstance(other, self.__class__):
-            return self.agent_positions == other.agent_positions and self.box_positions == other.box_positions
+            return self.zobrist_hash == other.zobrist_hash and \
+                   self.agent_positions == other.agent_positions and \
+                   (self.box_positions == other.box_positions or set(self.box_positions) == set(other.box_positions))
         else:
             return False
 
@@ -244,4 +450,170 @@ class HospitalState:
         Notice that we here only hash the agent positions and box positions, but ignore all other fields.
         That means that two states with identical positions but e.g. different parent will map to the same hash value.
         """
-        return hash((tuple(self.agent_positions), tuple(self.box_positions)))
+        return self.zobrist_hash
+
+
+# The two most recently decoded compact states. While expanding a state, the search alternates between querying the
+# expanded state and its newest successor, so remembering two decoded states avoids almost all repeated decoding.
+_decoded_states = [(None, None), (None, None)]
+
+# Joint actions are shared between all compact states reached by the same joint action instead of being stored once
+# per state.
+_interned_joint_actions = {}
+
+
+class CompactHospitalState:
+    """
+    CompactHospitalState is a memory efficient alternative to HospitalState for levels where the number of stored
+    states, rather than the time limit, is the bottleneck.
+    Instead of lists of (position, character) pairs, all agents and boxes are packed into a single immutable bytes
+    key where each object is stored as its cell index in the flattened level grid together with its character.
+    The hash of the key is computed once when the state is created.
+
+    The API is the same as the one of HospitalState: queries such as agent_at, box_at or get_applicable_actions are
+    answered by a HospitalState decoded from the key, while the search tree (parent, action and path_cost) is stored
+    in the compact states themselves such that extract_plan works as usual.
+    Note that agent_positions and box_positions are decoded copies, i.e. modifying them does not change the state.
+    """
+
+    __slots__ = ('level', 'key', 'hash', 'parent', 'action', 'path_cost')
+
+    def __init__(
+        self,
+        level: h_level.HospitalLevel,
+        key: bytes,
+        parent = None,
+        action: list[actions.AnyAction] = None
+    ):
+        self.level = level
+        self.key = key
+        self.hash = hash(key)
+        self.parent = parent
+        self.action = action
+        self.path_cost = 0 if parent is None else parent.path_cost + 1
+
+    @staticmethod
+    def from_state(state: HospitalState, parent = None, action: list[actions.AnyAction] = None):
+        """Packs a HospitalState into a CompactHospitalState"""
+        return CompactHospitalState(state.level, CompactHospitalState.pack(state), parent, action)
+
+    @staticmethod
+    def pack(state: HospitalState) -> bytes:
+        """
+        Encodes the agents and boxes of a state as a bytes key.
+        The key is an array of unsigned integers, where the first integer is the number of agents followed by one
+        integer per agent and box on the form (cell_index << 8) | ord(character). Since the boxes are sorted, two
+        states with the same agent and box positions always have the same key.
+        """
+        num_cols = state.level.num_cols
+        values = array('I', [len(state.agent_positions)])
+        values.extend([((row * num_cols + col) << 8) | (ord(char) if char else 0)
+                       for ((row, col), char) in state.agent_positions])
+        values.extend(sorted([((row * num_cols + col) << 8) | ord(char)
+                              for ((row, col), char) in state.box_positions if char]))
+        return values.tobytes()
+
+    def unpack(self) -> HospitalState:
+        """Decodes the key into a new HospitalState containing the same agents and boxes"""
+        values = array('I')
+        values.frombytes(self.key)
+        num_agents = values[0]
+        num_cols = self.level.num_cols
+        objects = [(divmod(value >> 8, num_cols), chr(value & 0xFF) if value & 0xFF else '') for value in values[1:]]
+        return HospitalState(self.level, objects[:num_agents], objects[num_agents:])
+
+    def decode(self) -> HospitalState:
+        """Returns a (cached) decoded HospitalState which must *not* be modified"""
+        recent, previous = _decoded_states
+        if recent[0] is self:
+            return recent[1]
+        if previous[0] is self:
+            _decoded_states[0], _decoded_states[1] = previous, recent
+            return previous[1]
+        decoded_state = self.unpack()
+        _decoded_states[0], _decoded_states[1] = (self, decoded_state), recent
+        return decoded_state
+
+    @property
+    def agent_positions(self) -> list[tuple[tuple[int, int], str]]:
+        return self.decode().agent_positions
+
+    @property
+    def box_positions(self) -> list[tuple[tuple[int, int], str]]:
+        return self.decode().box_positions
+
+    def agent_at(self, position: tuple[int, int]) -> tuple[int, str]:
+        return self.decode().agent_at(position)
+
+    def box_at(self, position: tuple[int, int]) -> tuple[int, str]:
+        return self.decode().box_at(position)
+
+    def object_at(self, position: tuple[int, int]) -> str:
+        return self.decode().object_at(position)
+
+    def free_at(self, position: tuple[int, int]) -> bool:
+        return self.decode().free_at(position)
+
+    def count_unsatisfied_goals(self, goal_description: h_goal_description.HospitalGoalDescription) -> int:
+        return self.decode().count_unsatisfied_goals(goal_description)
+
+    def is_deadlocked(self) -> bool:
+        return self.decode().is_deadlocked()
+
+    def extract_plan(self) -> list[actions.AnyAction]:
+        """Extracts a plan from the search tree by walking backwards through the search tree"""
+        reverse_plan = []
+        current_node = self
+        while current_node.parent is not None:
+            reverse_plan.append(current_node.action)
+            current_node = current_node.parent
+        reverse_plan.reverse()
+        return reverse_plan
+
+    def is_conflicting(self, joint_action: list[actions.AnyAction]) -> bool:
+        return self.decode().is_conflicting(joint_action)
+
+    def result(self, joint_action: list[actions.AnyAction]):
+        """Computes the compact state resulting from applying a joint action to this state"""
+        joint_action = tuple(joint_action)
+        joint_action = _interned_joint_actions.setdefault(joint_action, joint_action)
+        decoded_state = self.decode().result(joint_action)
+        new_state = CompactHospitalState.from_state(decoded_state, self, joint_action)
+        # The new state is typically queried right away, e.g. by the goal test, so we keep the decoded version around
+        _decoded_states[0], _decoded_states[1] = (new_state, decoded_state), _decoded_states[0]
+        return new_state
+
+    def result_of_plan(self, plan: list[list[actions.AnyAction]]):
+        """Computes the state resulting from applying a sequence of joint actions (a plan) to this state"""
+        new_state = CompactHospitalState(self.level, self.key)
+        for joint_action in plan:
+            new_state = new_state.result(joint_action)
+        return new_state
+
+    def is_applicable(self, joint_action: list[actions.AnyAction]) -> bool:
+        return self.decode().is_applicable(joint_action)
+
+    def iter_applicable_actions(self, action_set: list[list[actions.AnyAction]]):
+        return self.decode().iter_applicable_actions(action_set)
+
+    def get_applicable_actions(self, action_set: list[list[actions.AnyAction]]):
+        return self.decode().get_applicable_actions(action_set)
+
+    def color_filter(self, color: str):
+        return CompactHospitalState.from_state(self.decode().color_filter(color))
+
+    def __repr__(self) -> str:
+        return repr(self.decode())
+
+    def __eq__(self, other) -> bool:
+        """As for HospitalState, only the agent and box positions (i.e. the key) are compared"""
+        if isinstance(other, self.__class__):
+            return self.key == other.key
+        else:
+            return False
+
+    def __ne__(self, other) -> bool:
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return self.hash
@@ -13,12 +13,105 @@
 
 from math import inf
 import os
-import psutil
 
 max_usage = inf
-_process_id = psutil.Process
+_process = None
+
+# The fraction of the maximum memory usage at which a search should start to save memory
+LOW_MEMORY_FRACTION = 0.8
+
+# The states of a memory budget, see MemoryBudget.check
+MEMORY_OK = 0
+MEMORY_LOW = 1
+MEMORY_EXCEEDED = 2
 
 
 def get_usage():
-    process = psutil.Process(os.getpid())
-    return process.memory_info().rss
\ No newline at end of file
+    global _process
+    # The process is looked up again in forked processes. Since importing psutil takes a noticeable part of the startup
+    # time, it is only imported once the memory usage is needed.
+    if _process is None or _process.pid != os.getpid():
+        import psutil
+        _process = psutil.Process(os.getpid())
+    return _process.memory_info().rss
+
+
+class MemoryBudget:
+    """
+    A MemoryBudget allows a search to check its memory usage in every iteration at almost no cost.
+    Instead of reading the memory usage of the process in every iteration, it is only sampled every check_interval
+    iterations, and in between it is estimated from the number of nodes stored by the search and the average memory
+    cost per node observed so far. The reported state is always based on an actual sample, but an estimate crossing a
+    limit causes an early sample, such that a limit is noticed long before the next regular sample.
+
+    The check method reports MEMORY_LOW once LOW_MEMORY_FRACTION of the limit is used, at which point the search should
+    start to save memory (e.g. by using a HashedExploredSet), and MEMORY_EXCEEDED once the limit is exceeded, at which
+    point the search should stop or switch to an algorithm which needs less memory.
+    """
+
+    def __init__(self, limit: float = None, check_interval: int = 1000):
+        self.limit = max_usage if limit is None else limit
+        self.check_interval = check_interval
+        self.iterations = 0
+        self.initial_usage = get_usage()
+        self.sampled_usage = self.initial_usage
+        self.sampled_nodes = 0
+        self.bytes_per_node = 0.0
+        self.status = self.status_of(self.sampled_usage)
+
+    def sample(self, num_nodes: int) -> int:
+        """Reads the actual memory usage of the process and updates the memory cost per node"""
+        self.iterations = 0
+        self.sampled_usage = get_usage()
+        self.sampled_nodes = num_nodes
+        if num_nodes > 0:
+            self.bytes_per_node = max(0, self.sampled_usage - self.initial_usage) / num_nodes
+        return self.sampled_usage
+
+    def estimate_usage(self, num_nodes: int) -> float:
+        return self.sampled_usage + (num_nodes - self.sampled_nodes) * self.bytes_per_node
+
+    def remaining_nodes(self, num_nodes: int) -> float:
+        """Returns an estimate of how many more nodes can be stored before the limit is exceeded"""
+        if self.bytes_per_node == 0:
+            return inf
+        return max(0.0, (self.limit - self.estimate_usage(num_nodes)) / self.bytes_per_node)
+
+    def status_of(self, usage: float) -> int:
+        if usage > self.limit:
+            return MEMORY_EXCEEDED
+        if usage > self.limit * LOW_MEMORY_FRACTION:
+            return MEMORY_LOW
+        return MEMORY_OK
+
+    def check(self, num_nodes: int) -> int:
+        """
+        Returns MEMORY_OK, MEMORY_LOW or MEMORY_EXCEEDED given the number of nodes currently stored by the search
+        """
+        self.iterations += 1
+        # Early samples are still limited to one per tenth of the interval in case the estimate is too pessimistic
+        if self.iterations >= self.check_interval or (self.iterations * 10 >= self.check_interval and
+                                                      self.status_of(self.estimate_usage(num_nodes)) > self.status):
+            self.status = self.status_of(self.sample(num_nodes))
+        return self.status
+
+
+class HashedExploredSet:
+    """
+    An explored set which only stores the hashes of the states instead of the states themselves, such that the states
+    which are not referenced from the frontier (directly or as ancestors) can be freed.
+    A state is considered explored if an explored state has the same hash, so with a tiny probability (given by the
+    61-bit hashes of Python) a state can be skipped wrongly, which may make the search miss a plan.
+    """
+
+    def __init__(self, states=()):
+        self.hashes = {hash(state) for state in states}
+
+    def add(self, state):
+        self.hashes.add(hash(state))
+
+    def __contains__(self, state) -> bool:
+        return hash(state) in self.hashes
+
+    def __len__(self) -> int:
+        return len(self.hashes)
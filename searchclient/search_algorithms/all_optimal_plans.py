@@ -12,13 +12,7 @@
 # limitations under the License.
 
 import sys
-import time
-import memory
 from collections import deque
-try:
-    import graphviz
-except ImportError:
-    pass
 
 
 # A global variable used to generate unique node IDs
@@ -103,6 +97,9 @@ def visualize_solution_graph(solution_graph):
         engine (see https://graphviz.org/download/) and the graphviz python package (pip install graphviz).
     """
 
+    # The optional graphviz package is only imported when a solution graph is actually visualized
+    import graphviz
+
     graph = graphviz.Digraph()
     graph.format = "svg"
 
@@ -152,25 +149,9 @@ def all_optimal_plans(initial_state, action_set, possible_goals, frontier):
     frontier.add(root)
     generated_states = {}
 
+    # To follow the progress of the search, import telemetry, create a telemetry.SearchTelemetry and write a record
+    # whenever iterations reaches its next_record, just like in graph_search
+
     # Your implementation of ALL-OPTIMAL-PLANS goes here...
     raise NotImplementedError()
 
-
-# A global variable used to keep track of the start time of the current search
-start_time = 0
-
-
-def print_search_status(generated, frontier):
-    global start_time
-    if len(generated) == 0:
-        start_time = time.time()
-    memory_usage_bytes = memory.get_usage()
-    # Replacing the generated comma thousands separators with dots is neither pretty nor locale aware but none of
-    # Pythons four different formatting facilities seems to handle this correctly!
-    num_frontier = f"{frontier.size():8,d}".replace(',', '.')
-    num_generated = f"{len(generated):8,d}".replace(',', '.')
-    elapsed_time = f"{time.time() - start_time:3.3f}".replace('.',',')
-    memory_usage_mb = f"{memory_usage_bytes / (1024*1024):3.2f}".replace('.',',')
-    status_text = f"##Frontier: {num_frontier}, #Generated: {num_generated}," \
-                  f" Time: {elapsed_time} s, Memory: {memory_usage_mb} MB\n"
-    print(status_text, file=sys.stderr)
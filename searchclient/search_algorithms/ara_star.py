@@ -0,0 +1,166 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import sys
+import time
+import memory
+import telemetry
+
+import domains.hospital.actions as actions
+import domains.hospital.state as h_state
+import domains.hospital.goal_description as h_goal_description
+from strategies.bestfirst import BucketPriorityQueue
+from utils import APPROX_INFINITY
+
+# Anytime repairing A* (Likhachev, Gordon and Thrun 2003) runs a series of weighted A* searches with f = g + w * h,
+# starting with a large weight w, which finds a plan quickly, and decreasing w after each search until w = 1, where the
+# plan found is optimal if the heuristic is admissible. With an admissible heuristic, the plan found by each search
+# costs at most w times the optimal cost.
+#
+# Instead of starting over, each search continues from where the previous one stopped: the open list is kept (with the
+# priorities recomputed for the new weight), and so are the path costs of all states found so far. Within a search,
+# every state is expanded at most once, so a state which is reached by a cheaper path after it has been expanded is
+# set aside as inconsistent and only reopened by the next search. A search stops as soon as no state in the open list
+# has a lower priority than the cost of the best plan found so far, and states which cannot lead to a cheaper plan than
+# that are dropped altogether.
+
+# The weight of the first search, and how much the weight is decreased between searches
+INITIAL_WEIGHT = 5.0
+WEIGHT_STEP = 1.0
+
+# The number of expansions between checks of the deadline and the memory usage
+EXPANSIONS_PER_CHECK = 100
+
+
+def ara_star(
+        initial_state:      h_state.HospitalState,
+        action_set:         list[list[actions.AnyAction]],
+        goal_description:   h_goal_description.HospitalGoalDescription,
+        heuristic,
+        deadline:           float = None,
+        initial_weight:     float = INITIAL_WEIGHT,
+        weight_step:        float = WEIGHT_STEP,
+        on_plan=None
+    ) -> tuple[bool, list[list[actions.AnyAction]]]:
+    """
+    Searches for plans of decreasing cost using ARA* with the given heuristic (or None to use h = 0) and returns the
+    best plan found as a (boolean, plan) pair just like graph_search. The search stops once the plan is known to be
+    optimal, or at the deadline (given in seconds from now, or None to never stop early) if a plan has been found by
+    then. Every time a better plan is found, on_plan (if given) is called with the plan and its suboptimality bound.
+    """
+    start_time = time.time()
+    initial_state.parent = None
+    initial_state.path_cost = 0
+    if goal_description.is_goal(initial_state):
+        return True, []
+
+    def h(state):
+        return heuristic.h(state, goal_description) if heuristic is not None else 0
+
+    # Maps every state found so far into the state object with the cheapest path to it and its h-value
+    nodes = {initial_state: (initial_state, h(initial_state))}
+    if nodes[initial_state][1] >= APPROX_INFINITY:
+        print("ARA*: the initial state is a dead end", file=sys.stderr, flush=True)
+        return False, []
+    open_states = BucketPriorityQueue()
+    open_states.add(initial_state, 0, nodes[initial_state][1])
+    closed = set()
+    inconsistent = set()
+    best_goal = None
+    reported_goal = None
+    weight = max(1.0, initial_weight)
+    num_expanded = 0
+    memory_budget = memory.MemoryBudget(check_interval=1000 // EXPANSIONS_PER_CHECK)
+    search_telemetry = telemetry.SearchTelemetry('ara_star')
+
+    def best_cost():
+        return best_goal.path_cost if best_goal is not None else APPROX_INFINITY
+
+    def is_out_of_time():
+        return deadline is not None and best_goal is not None and time.time() - start_time >= deadline
+
+    while True:
+        # Expand states until no state in the open list can lead to a cheaper plan with the current weight
+        is_interrupted = False
+        while open_states.size() > 0:
+            state = open_states.pop()
+            state, state_h = nodes[state]
+            if state.path_cost + weight * state_h >= best_cost():
+                open_states.add(state, state.path_cost + weight * state_h, state_h)
+                break
+
+            num_expanded += 1
+            if num_expanded == search_telemetry.next_record:
+                search_telemetry.record(num_expanded, num_expanded, len(nodes), open_states.size(), len(closed))
+            if num_expanded % EXPANSIONS_PER_CHECK == 0:
+                if memory_budget.check(len(nodes)) == memory.MEMORY_EXCEEDED:
+                    print("ARA*: maximum memory usage exceeded", file=sys.stderr, flush=True)
+                    return best_goal is not None, best_goal.extract_plan() if best_goal is not None else []
+                if is_out_of_time():
+                    is_interrupted = True
+                    break
+
+            closed.add(state)
+            for joint_action in state.iter_applicable_actions(action_set):
+                child = state.result(joint_action)
+                g = child.path_cost
+                node = nodes.get(child)
+                if node is not None and node[0].path_cost <= g:
+                    continue
+                child_h = node[1] if node is not None else h(child)
+                if child_h >= APPROX_INFINITY or g + child_h >= best_cost():
+                    continue
+
+                if goal_description.is_goal(child):
+                    best_goal = child
+                    nodes[child] = (child, child_h)
+                    continue
+
+                nodes[child] = (child, child_h)
+                if child in closed:
+                    inconsistent.add(child)
+                elif open_states.contains(child):
+                    open_states.change_priority(child, g + weight * child_h, child_h)
+                else:
+                    open_states.add(child, g + weight * child_h, child_h)
+
+        if best_goal is None:
+            print(f"ARA*: no plan found after expanding {num_expanded} states in {time.time() - start_time:.3f} s",
+                  file=sys.stderr, flush=True)
+            return False, []
+
+        # The plan costs at most the bound times the optimal cost, since every cheaper plan passes a state in the open
+        # list or an inconsistent state with an f-value at most the optimal cost
+        pending = [nodes[state][0] for state in open_states.elements()] + [nodes[state][0] for state in inconsistent]
+        lowest_f = min((state.path_cost + nodes[state][1] for state in pending), default=best_cost())
+        bound = max(1.0, min(weight, best_cost() / lowest_f)) if lowest_f > 0 else weight
+        if best_goal is not reported_goal:
+            reported_goal = best_goal
+            print(f"ARA*: found plan of length {best_cost()} (at most {bound:.2f} times optimal) with weight {weight} "
+                  f"after expanding {num_expanded} states in {time.time() - start_time:.3f} s", file=sys.stderr,
+                  flush=True)
+            if on_plan is not None:
+                on_plan(best_goal.extract_plan(), bound)
+
+        if bound <= 1.0 or is_interrupted or is_out_of_time():
+            return True, best_goal.extract_plan()
+
+        # Start the next search with a lower weight from the open list and the inconsistent states
+        weight = max(1.0, weight - weight_step)
+        open_states.clear()
+        for state in pending:
+            state_h = nodes[state][1]
+            if state.path_cost + state_h < best_cost():
+                open_states.add(state, state.path_cost + weight * state_h, state_h)
+        inconsistent.clear()
+        closed.clear()
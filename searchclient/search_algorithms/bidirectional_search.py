@@ -0,0 +1,167 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import sys
+import time
+import memory
+
+import domains.hospital.actions as actions
+import domains.hospital.state as h_state
+import domains.hospital.goal_description as h_goal_description
+
+# On levels without boxes where every agent has a goal cell, the goal description is satisfied by exactly one state,
+# so we can search backwards from it just as easily as forwards from the initial state. A bidirectional breadth-first
+# search grows a search tree from both ends and stops once they meet in the middle, which for a plan of length d
+# explores about twice the states within distance d / 2 of either end instead of all states within distance d.
+#
+# Searching backwards needs a reversed action model: a joint action taking the state P to S must be undone by a
+# joint action taking S to P. For Move and NoOp actions this is simply the joint action moving every agent in the
+# opposite direction, which is applicable in S exactly when the original joint action is applicable in P: a Move is
+# applicable when its destination is free, so the reversed Move leads back into the cell the agent just vacated, and
+# agents can never follow each other, so no other agent can have moved into that cell. The backward search therefore
+# uses the ordinary successor function of HospitalState with the reversed actions, and the plan is its path turned
+# around with every action replaced by its inverse.
+#
+# The searches expand one complete breadth-first layer at a time, always on the side with the smaller layer. When a
+# generated state has been reached by the other side, the two paths form a plan. Since the other side has reached every
+# state within its current depth, the shortest plan found while completing the layer is a shortest plan overall (this
+# is the MM algorithm of Holte et al. 2016 with h = 0).
+
+
+def reverse_action_set(action_set: list[list[actions.AnyAction]]) -> tuple[list[list[actions.AnyAction]], dict]:
+    """
+    Returns the action set of the backward search and a map from each of its actions into the forward action undoing
+    it, or None if some action of the action set has no inverse in the action set.
+    """
+    reversed_action_set = []
+    inverses = {}
+    for action_library in action_set:
+        reversed_action_library = []
+        for action in action_library:
+            if isinstance(action, actions.NoOpAction):
+                inverse = action
+            elif isinstance(action, actions.MoveAction):
+                opposite_delta = (-action.agent_delta[0], -action.agent_delta[1])
+                inverse = next((other for other in action_library if isinstance(other, actions.MoveAction) and
+                                other.agent_delta == opposite_delta), None)
+                if inverse is None:
+                    return None
+            else:
+                # Only Move and NoOp actions can be reversed
+                return None
+            reversed_action_library.append(action)
+            inverses[action] = inverse
+        reversed_action_set.append(reversed_action_library)
+    return reversed_action_set, inverses
+
+
+def goal_state(
+        initial_state:      h_state.HospitalState,
+        goal_description:   h_goal_description.HospitalGoalDescription
+    ) -> h_state.HospitalState:
+    """Returns the only state satisfying the goal description, or None if there are boxes or agents without a goal"""
+    if initial_state.box_positions or goal_description.box_goals:
+        return None
+    goal_positions = {}
+    for (position, char, is_positive) in goal_description.agent_goals:
+        if not is_positive or char in goal_positions:
+            return None
+        goal_positions[char] = position
+    agent_chars = [char for (_, char) in initial_state.agent_positions]
+    if len(goal_positions) != len(agent_chars) or set(agent_chars) != set(goal_positions):
+        return None
+    return h_state.HospitalState(initial_state.level, [(goal_positions[char], char) for char in agent_chars], [])
+
+
+def is_supported(initial_state, action_set, goal_description) -> bool:
+    return isinstance(initial_state, h_state.HospitalState) and \
+        goal_state(initial_state, goal_description) is not None and reverse_action_set(action_set) is not None
+
+
+def bidirectional_search(
+        initial_state:      h_state.HospitalState,
+        action_set:         list[list[actions.AnyAction]],
+        goal_description:   h_goal_description.HospitalGoalDescription
+    ) -> tuple[bool, list[list[actions.AnyAction]]]:
+    """
+    Searches for a shortest plan using bidirectional breadth-first search and returns a (boolean, plan) pair just like
+    graph_search. Only levels for which is_supported returns true can be solved, on other levels it fails right away.
+    """
+    start_time = time.time()
+    reversed_action_set = reverse_action_set(action_set)
+    final_state = goal_state(initial_state, goal_description)
+    if reversed_action_set is None or final_state is None:
+        print("Bidirectional search: the level must have no boxes, every agent must have a goal and all actions "
+              "must be reversible", file=sys.stderr, flush=True)
+        return False, []
+    reversed_action_set, inverses = reversed_action_set
+    initial_state.parent = None
+    initial_state.path_cost = 0
+    if initial_state == final_state:
+        return True, []
+
+    # The states reached by each side (mapping each state into itself to find the node with the path to it) and the
+    # current breadth-first layers
+    forward_reached = {initial_state: initial_state}
+    backward_reached = {final_state: final_state}
+    forward_layer = [initial_state]
+    backward_layer = [final_state]
+    memory_budget = memory.MemoryBudget()
+    num_expanded = 0
+
+    while forward_layer and backward_layer:
+        is_forward = len(forward_layer) <= len(backward_layer)
+        if is_forward:
+            layer, reached, other_reached, layer_action_set = \
+                forward_layer, forward_reached, backward_reached, action_set
+        else:
+            layer, reached, other_reached, layer_action_set = \
+                backward_layer, backward_reached, forward_reached, reversed_action_set
+
+        # Expand the whole layer, remembering the shortest plan through a state reached by both sides
+        next_layer = []
+        best_meeting = None
+        best_length = None
+        for state in layer:
+            num_expanded += 1
+            if memory_budget.check(len(forward_reached) + len(backward_reached)) == memory.MEMORY_EXCEEDED:
+                print('Maximum memory usage exceeded!', file=sys.stderr, flush=True)
+                return False, []
+            for joint_action in state.iter_applicable_actions(layer_action_set):
+                child = state.result(joint_action)
+                if child in reached:
+                    continue
+                reached[child] = child
+                next_layer.append(child)
+                other = other_reached.get(child)
+                if other is not None and (best_length is None or child.path_cost + other.path_cost < best_length):
+                    best_meeting = (child, other) if is_forward else (other, child)
+                    best_length = child.path_cost + other.path_cost
+
+        if best_meeting is not None:
+            forward_node, backward_node = best_meeting
+            backward_plan = backward_node.extract_plan()
+            plan = forward_node.extract_plan() + \
+                [tuple(inverses[action] for action in joint_action) for joint_action in reversed(backward_plan)]
+            print(f"Bidirectional search: found plan of length {len(plan)} after expanding {num_expanded} states "
+                  f"({len(forward_reached)} forward, {len(backward_reached)} backward) in "
+                  f"{time.time() - start_time:.3f} s", file=sys.stderr, flush=True)
+            return True, plan
+
+        if is_forward:
+            forward_layer = next_layer
+        else:
+            backward_layer = next_layer
+
+    print(f"Bidirectional search: no plan found after expanding {num_expanded} states", file=sys.stderr, flush=True)
+    return False, []
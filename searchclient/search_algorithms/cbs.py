@@ -0,0 +1,225 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import heapq
+import itertools
+import sys
+import time
+import memory
+
+import domains.hospital.actions as actions
+import domains.hospital.state as h_state
+import domains.hospital.goal_description as h_goal_description
+from utils import pos_add, GenericNoOp, APPROX_INFINITY
+
+# Conflict-Based Search (Sharon et al. 2015) for levels where the agents only need to move, i.e. the MAPF levels.
+#
+# The high level searches a constraint tree. Each node contains a set of constraints for every agent and a path
+# for every agent which is the shortest path satisfying the agent's constraints. When the paths of two agents
+# conflict, the node is split into two children, each of which forbids one of the agents from being involved.
+#
+# Since a Move action in the hospital domain requires the destination to be free *before* the joint action is
+# performed, two kinds of conflicts are detected:
+# - Vertex conflicts, where two agents occupy the same cell at the same time.
+# - Edge conflicts, where an agent moves into a cell occupied by another agent in the previous time step. This
+#   includes two agents swapping positions as well as an agent following right behind another agent.
+# A constraint (cell, time) forbids an agent from being at the cell at the given time.
+#
+# The constraint tree is searched in order of the makespan (the length of the joint plan) breaking ties by the sum of
+# the individual path lengths, which means that the returned plan has minimal length.
+
+
+class ConstraintTreeNode:
+
+    def __init__(self, constraints: list[frozenset], paths: list[list[tuple[int, int]]]):
+        self.constraints = constraints
+        self.paths = paths
+        self.makespan = max(len(path) - 1 for path in paths)
+        self.sum_of_costs = sum(len(path) - 1 for path in paths)
+
+
+def position_at(path: list[tuple[int, int]], t: int) -> tuple[int, int]:
+    """Agents stay at their final position once they reach the end of their path"""
+    return path[t] if t < len(path) else path[-1]
+
+
+def find_first_conflict(paths: list[list[tuple[int, int]]]):
+    """
+    Returns the first conflict between the paths as a pair of constraints (agent_index, cell, time), one for each of
+    the two involved agents, or None if the paths are conflict free.
+    """
+    makespan = max(len(path) for path in paths)
+    for t in range(makespan):
+        occupied = {}
+        for (agent_index, path) in enumerate(paths):
+            position = position_at(path, t)
+            # Vertex conflict: two agents at the same cell at the same time
+            if position in occupied:
+                other_index = occupied[position]
+                return (agent_index, position, t), (other_index, position, t)
+            occupied[position] = agent_index
+        if t == 0:
+            continue
+        previously_occupied = {position_at(path, t - 1): agent_index for (agent_index, path) in enumerate(paths)}
+        for (agent_index, path) in enumerate(paths):
+            position = position_at(path, t)
+            other_index = previously_occupied.get(position, agent_index)
+            # Edge conflict: moving into a cell which was occupied by another agent in the previous time step
+            if other_index != agent_index:
+                return (agent_index, position, t), (other_index, position, t - 1)
+    return None
+
+
+def space_time_astar(level, blocked: set, start: tuple[int, int], goal, constraints: frozenset):
+    """
+    Finds a shortest path from start to goal (or, if goal is None, just any path) which never violates a constraint.
+    The path is returned as a list of positions, one for each time step, or None if no such path exists.
+    The agent must be able to stay at the goal forever, i.e. it must arrive after the last constraint on the goal.
+    """
+    if goal is not None and level.distances.distance(goal, start) == APPROX_INFINITY:
+        return None
+
+    last_constraint_time = {}
+    for (cell, t) in constraints:
+        last_constraint_time[cell] = max(t, last_constraint_time.get(cell, -1))
+    # Once all constraints have passed, any shortest path visits each cell at most once, so if no path has been
+    # found within this bound, the agent cannot reach its goal
+    time_bound = max(last_constraint_time.values(), default=0) + level.num_cells + 1
+
+    # The distances from the goal (ignoring boxes) are an admissible heuristic
+    goal_distances = level.distances.distances_from(goal) if goal is not None else None
+
+    def h(position):
+        return 0 if goal is None else goal_distances[level.cell_index(position)]
+
+    counter = itertools.count()
+    start_node = (start, 0)
+    parents = {start_node: None}
+    queue = [(h(start), -next(counter), start_node)]
+    while queue:
+        _, _, node = heapq.heappop(queue)
+        position, t = node
+        if (goal is None or position == goal) and t > last_constraint_time.get(position, -1):
+            path = []
+            while node is not None:
+                path.append(node[0])
+                node = parents[node]
+            path.reverse()
+            return path
+        if t >= time_bound:
+            continue
+        for delta in ((0, 0), *actions.direction_deltas.values()):
+            neighbour = pos_add(position, delta)
+            child = (neighbour, t + 1)
+            if child in parents or level.wall_at(neighbour) or neighbour in blocked or \
+                    (neighbour, t + 1) in constraints:
+                continue
+            parents[child] = node
+            heapq.heappush(queue, (t + 1 + h(neighbour), -next(counter), child))
+    return None
+
+
+def conflict_based_search(
+        initial_state:      h_state.HospitalState,
+        action_set:         list[list[actions.AnyAction]],
+        goal_description:   h_goal_description.HospitalGoalDescription,
+    ) -> tuple[bool, list[list[actions.AnyAction]]]:
+    """
+    Computes a joint plan of minimal length for a level where the agents only need to move, using Conflict-Based
+    Search. Each agent is planned for individually by a space-time A* and the plans are returned as a list of joint
+    actions consisting of the Move and NoOp actions from the action set. Boxes are treated as static obstacles.
+    """
+    start_time = time.time()
+    level = initial_state.level
+    num_agents = len(initial_state.agent_positions)
+
+    if len(goal_description.box_goals) > 0:
+        print("Conflict-based search only supports levels without box goals", file=sys.stderr)
+        return False, []
+
+    # Look up the actions used to construct the joint plan from the individual paths
+    moves = []
+    for agent_index in range(num_agents):
+        agent_moves = {(0, 0): GenericNoOp()}
+        for action in action_set[agent_index]:
+            if isinstance(action, actions.MoveAction):
+                agent_moves[action.agent_delta] = action
+            elif isinstance(action, actions.NoOpAction):
+                agent_moves[(0, 0)] = action
+        moves.append(agent_moves)
+
+    blocked = {box_position for (box_position, box_char) in initial_state.box_positions if box_char != ''}
+    goals = {goal_char: goal_position for (goal_position, goal_char, is_positive) in goal_description.agent_goals
+             if is_positive}
+    agent_goals = [goals.get(agent_char) for (_, agent_char) in initial_state.agent_positions]
+
+    def plan_agent(agent_index, constraints):
+        return space_time_astar(level, blocked, initial_state.agent_positions[agent_index][0],
+                                agent_goals[agent_index], constraints)
+
+    # Compute the root of the constraint tree, where all agents follow their individually shortest paths
+    root_constraints = [frozenset()] * num_agents
+    root_paths = []
+    for agent_index in range(num_agents):
+        path = plan_agent(agent_index, root_constraints[agent_index])
+        if path is None:
+            print(f"Agent {agent_index} cannot reach its goal", file=sys.stderr)
+            return False, []
+        root_paths.append(path)
+
+    counter = itertools.count()
+    root = ConstraintTreeNode(root_constraints, root_paths)
+    open_nodes = [(root.makespan, root.sum_of_costs, next(counter), root)]
+    iterations = 0
+    memory_budget = memory.MemoryBudget()
+
+    while open_nodes:
+        # Ensure that we do not use more memory than allowed
+        if memory_budget.check(len(open_nodes)) == memory.MEMORY_EXCEEDED:
+            print('Maximum memory usage exceeded!', file=sys.stderr, flush=True)
+            return False, []
+        iterations += 1
+
+        _, _, _, node = heapq.heappop(open_nodes)
+        conflict = find_first_conflict(node.paths)
+        if conflict is None:
+            print(f"Conflict-based search expanded {iterations} constraint tree nodes in "
+                  f"{time.time() - start_time:.3f} s", file=sys.stderr)
+            return True, paths_to_plan(node.paths, moves, node.makespan)
+
+        # Split the node by adding each of the two constraints in turn
+        for (agent_index, cell, t) in conflict:
+            constraints = list(node.constraints)
+            constraints[agent_index] = node.constraints[agent_index] | {(cell, t)}
+            path = plan_agent(agent_index, constraints[agent_index])
+            if path is None:
+                continue
+            paths = list(node.paths)
+            paths[agent_index] = path
+            child = ConstraintTreeNode(constraints, paths)
+            heapq.heappush(open_nodes, (child.makespan, child.sum_of_costs, next(counter), child))
+
+    return False, []
+
+
+def paths_to_plan(paths, moves, makespan):
+    """Converts the individual paths into a list of joint actions"""
+    plan = []
+    for t in range(makespan):
+        joint_action = []
+        for (agent_index, path) in enumerate(paths):
+            delta = (position_at(path, t + 1)[0] - position_at(path, t)[0],
+                     position_at(path, t + 1)[1] - position_at(path, t)[1])
+            joint_action.append(moves[agent_index][delta])
+        plan.append(joint_action)
+    return plan
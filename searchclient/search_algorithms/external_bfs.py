@@ -0,0 +1,210 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import heapq
+import os
+import shutil
+import sys
+import tempfile
+import time
+import memory
+import telemetry
+
+import domains.hospital.actions as actions
+import domains.hospital.state as h_state
+import domains.hospital.goal_description as h_goal_description
+
+# External-memory breadth-first search with delayed duplicate detection (Korf 2003) for levels whose state space does
+# not fit in memory.
+#
+# States are stored on disk as the bytes keys of CompactHospitalState, which all have the same length within a level.
+# Every BFS layer is kept in its own file of sorted keys. To generate the next layer, the current layer is read
+# sequentially and the generated keys are collected in memory until the buffer is full, at which point the buffer is
+# sorted and written as a run file. When the layer has been expanded, the runs are merged into a single sorted stream,
+# from which duplicates are removed together with every key already present in a previous layer. The keys of all
+# previous layers are kept merged in a single sorted file, such that this only takes a sequential pass over the files.
+# Hence, only the buffer needs to fit in memory.
+#
+# Since no parent pointers are stored, the plan is reconstructed by a backward pass once a goal has been generated:
+# starting from the expanded state which generated the goal, each previous layer is scanned for a state with a
+# successor equal to the state found in the layer after it.
+
+# The fraction of the memory limit used for buffering generated states before they are written as a run
+RUN_MEMORY_FRACTION = 0.25
+# A rough estimate of the memory used per buffered key (in addition to the key itself) by a Python bytes object in a set
+BUFFERED_KEY_OVERHEAD = 100
+# The maximum number of keys in a run, used when the memory limit is not set
+MAX_RUN_SIZE = 1 << 22
+# The number of keys read at a time from a file
+READ_CHUNK_SIZE = 1 << 14
+
+
+def read_keys(path: str, key_size: int):
+    """Yields the keys stored in the given file"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(key_size * READ_CHUNK_SIZE)
+            if not chunk:
+                return
+            for offset in range(0, len(chunk), key_size):
+                yield chunk[offset:offset + key_size]
+
+
+def write_keys(path: str, keys) -> int:
+    """Writes the keys to the given file and returns the number of keys written"""
+    count = 0
+    with open(path, 'wb') as f:
+        chunk = []
+        for key in keys:
+            chunk.append(key)
+            if len(chunk) == READ_CHUNK_SIZE:
+                f.write(b''.join(chunk))
+                count += len(chunk)
+                chunk = []
+        f.write(b''.join(chunk))
+        count += len(chunk)
+    return count
+
+
+def remove_duplicates(sorted_keys, sorted_visited_keys):
+    """Yields the sorted keys without repetitions and without the keys of the sorted visited keys"""
+    visited_key = next(sorted_visited_keys, None)
+    previous_key = None
+    for key in sorted_keys:
+        if key == previous_key:
+            continue
+        previous_key = key
+        while visited_key is not None and visited_key < key:
+            visited_key = next(sorted_visited_keys, None)
+        if visited_key != key:
+            yield key
+
+
+def external_bfs(
+        initial_state:      h_state.HospitalState,
+        action_set:         list[list[actions.AnyAction]],
+        goal_description:   h_goal_description.HospitalGoalDescription,
+        directory:          str = None
+    ) -> tuple[bool, list[list[actions.AnyAction]]]:
+    """
+    Searches for a shortest plan using breadth-first search where the states are stored in files in a temporary sub
+    directory of the given directory (or of the default temporary directory), which is deleted afterwards.
+    Returns a (boolean, plan) pair just like graph_search.
+    """
+    start_time = time.time()
+    if isinstance(initial_state, h_state.CompactHospitalState):
+        initial_state = initial_state.unpack()
+    level = initial_state.level
+    if goal_description.is_goal(initial_state):
+        return True, []
+
+    initial_key = h_state.CompactHospitalState.pack(initial_state)
+    key_size = len(initial_key)
+    if memory.max_usage == float('inf'):
+        run_size = MAX_RUN_SIZE
+    else:
+        run_size = max(1024, int(memory.max_usage * RUN_MEMORY_FRACTION / (key_size + BUFFERED_KEY_OVERHEAD)))
+
+    def unpack(key):
+        return h_state.CompactHospitalState(level, key).unpack()
+
+    work_directory = tempfile.mkdtemp(prefix='external_bfs_', dir=directory)
+    try:
+        layer_paths = [os.path.join(work_directory, 'layer_0')]
+        write_keys(layer_paths[0], [initial_key])
+        visited_path = os.path.join(work_directory, 'visited_0')
+        write_keys(visited_path, [initial_key])
+        num_visited = 1
+        layer_size = 1
+        search_telemetry = telemetry.SearchTelemetry('external_bfs')
+        num_expanded = 0
+        num_generated = 1
+
+        while True:
+            depth = len(layer_paths) - 1
+            # Expand the current layer into sorted runs of generated keys, stopping as soon as a goal is generated
+            run_paths = []
+            buffer = set()
+            goal = None
+            num_layer_expanded = 0
+            for key in read_keys(layer_paths[-1], key_size):
+                num_expanded += 1
+                num_layer_expanded += 1
+                # The frontier consists of the states of the current layer which have not been expanded yet
+                if num_expanded == search_telemetry.next_record:
+                    search_telemetry.record(num_expanded, num_expanded, num_generated, layer_size - num_layer_expanded,
+                                            num_visited)
+                state = unpack(key)
+                for joint_action in state.iter_applicable_actions(action_set):
+                    child = state.result(joint_action)
+                    num_generated += 1
+                    if goal_description.is_goal(child):
+                        goal = (key, joint_action)
+                        break
+                    buffer.add(h_state.CompactHospitalState.pack(child))
+                if goal is not None:
+                    break
+                if len(buffer) >= run_size:
+                    run_paths.append(os.path.join(work_directory, f'run_{len(run_paths)}'))
+                    write_keys(run_paths[-1], sorted(buffer))
+                    buffer.clear()
+
+            if goal is not None:
+                print(f"External BFS: found goal at depth {depth + 1} after {time.time() - start_time:.3f} s, "
+                      f"reconstructing the plan", file=sys.stderr, flush=True)
+                return True, reconstruct_plan(layer_paths, key_size, unpack, action_set, *goal)
+
+            if buffer:
+                run_paths.append(os.path.join(work_directory, f'run_{len(run_paths)}'))
+                write_keys(run_paths[-1], sorted(buffer))
+                buffer.clear()
+
+            # Merge the runs into the next layer and add the next layer to the visited keys
+            next_layer_path = os.path.join(work_directory, f'layer_{depth + 1}')
+            merged_runs = heapq.merge(*[read_keys(run_path, key_size) for run_path in run_paths])
+            layer_size = write_keys(next_layer_path,
+                                    remove_duplicates(merged_runs, read_keys(visited_path, key_size)))
+            for run_path in run_paths:
+                os.remove(run_path)
+            if layer_size == 0:
+                return False, []
+            layer_paths.append(next_layer_path)
+
+            next_visited_path = os.path.join(work_directory, f'visited_{depth + 1}')
+            write_keys(next_visited_path, heapq.merge(read_keys(visited_path, key_size),
+                                                      read_keys(next_layer_path, key_size)))
+            os.remove(visited_path)
+            visited_path = next_visited_path
+            num_visited += layer_size
+
+            print(f"External BFS: depth {depth + 1:4d}, layer size {layer_size:12,d}, visited {num_visited:14,d}, "
+                  f"runs {len(run_paths):4d}, time {time.time() - start_time:.3f} s, "
+                  f"memory {memory.get_usage() / (1024 * 1024):.2f} MB", file=sys.stderr, flush=True)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+def reconstruct_plan(layer_paths, key_size, unpack, action_set, goal_parent_key, goal_joint_action):
+    plan = [list(goal_joint_action)]
+    target_key = goal_parent_key
+    for layer_path in reversed(layer_paths[:-1]):
+        for key in read_keys(layer_path, key_size):
+            state = unpack(key)
+            joint_action = next((joint_action for joint_action in state.iter_applicable_actions(action_set)
+                                 if h_state.CompactHospitalState.pack(state.result(joint_action)) == target_key), None)
+            if joint_action is not None:
+                plan.append(list(joint_action))
+                target_key = key
+                break
+    plan.reverse()
+    return plan
@@ -12,8 +12,8 @@
 # limitations under the License.
 from __future__ import annotations
 import sys
-import time
 import memory
+import telemetry
 from typing import Union
 
 import domains.hospital.actions as actions
@@ -32,10 +32,6 @@ def graph_search(
         goal_description:   goal_description.HospitalGoalDescription,
         frontier:           bfs.FrontierBFS
     ) -> tuple[bool, list[list[actions.AnyAction]]]:
-    global start_time
-
-    # Set start time
-    start_time = time.time()
     iterations = 0
     frontier.prepare(goal_description)
 
@@ -71,17 +67,25 @@ def graph_search(
         ]
     frontier.add(initial_state)
     expanded = set()
+    memory_budget = memory.MemoryBudget()
+    search_telemetry = telemetry.SearchTelemetry('graph_search')
 
     while True:
 
-        # Print a progress status message every 10000 iterations
-        if iterations % 10000 == 0 and iterations != 0:
-            print_search_status(expanded, frontier)
-
-        # Ensure that we do not use more memory than allowed
-        if memory.get_usage() > memory.max_usage:
+        # Write a telemetry record (or print a status line) at the interval given by --telemetry-interval
+        if iterations == search_telemetry.next_record:
+            search_telemetry.record(iterations, len(expanded), len(expanded) + frontier.size(), frontier.size(),
+                                    len(expanded))
+
+        # Ensure that we do not use more memory than allowed. When memory is getting low, only the hashes of the
+        # expanded states are kept, which frees the expanded states that are not ancestors of states in the frontier.
+        memory_status = memory_budget.check(len(expanded) + frontier.size())
+        if memory_status == memory.MEMORY_LOW and not isinstance(expanded, memory.HashedExploredSet):
+            print('Memory is getting low, only storing the hashes of the expanded states', file=sys.stderr, flush=True)
+            expanded = memory.HashedExploredSet(expanded)
+        elif memory_status == memory.MEMORY_EXCEEDED:
             print('Maximum memory usage exceeded!', file=sys.stderr, flush=True)
-            sys.exit(-1)
+            return False, []
 
         iterations += 1
 
@@ -89,23 +93,3 @@ def graph_search(
 
         raise NotImplementedError()
 
-
-# A global variable used to keep track of the start time of the current search
-start_time = 0
-
-
-def print_search_status(expanded, frontier):
-    global start_time
-    if len(expanded) == 0:
-        start_time = time.time()
-    memory_usage_bytes = memory.get_usage()
-    # Replacing the generated comma thousands separators with dots is neither pretty nor locale aware but none of
-    # Pythons four different formatting facilities seems to handle this correctly!
-    num_expanded = f"{len(expanded):8,d}".replace(',', '.')
-    num_frontier = f"{frontier.size():8,d}".replace(',', '.')
-    num_generated = f"{len(expanded) + frontier.size():8,d}".replace(',', '.')
-    elapsed_time = f"{time.time() - start_time:3.3f}".replace('.', ',')
-    memory_usage_mb = f"{memory_usage_bytes / (1024*1024):3.2f}".replace('.', ',')
-    status_text = f"#Expanded: {num_expanded}, #Frontier: {num_frontier}, #Generated: {num_generated}," \
-                  f" Time: {elapsed_time} s, Memory: {memory_usage_mb} MB"
-    print(status_text, file=sys.stderr)
@@ -0,0 +1,362 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import multiprocessing
+import queue
+import sys
+import time
+import memory
+import telemetry
+
+import domains.hospital.actions as actions
+import domains.hospital.state as h_state
+import domains.hospital.goal_description as h_goal_description
+from strategies.bestfirst import BucketPriorityQueue
+from utils import APPROX_INFINITY, plan_from_action_names
+
+# Hash Distributed A* (Kishimoto et al. 2009) runs a best-first search in several worker processes at once.
+#
+# Every state is owned by exactly one worker, given by the Zobrist hash of the state modulo the number of workers, and
+# only the owner stores the state and detects whether it is a duplicate. A worker expands the states of its own open
+# list and sends the generated successors to their owners. Successors are packed into the bytes keys of
+# CompactHospitalState and collected in one batch per destination, such that many states are sent per message.
+# Each stored state remembers its parent key and the names of the joint action leading to it, and the plan is
+# reconstructed at the end by asking the owners of the states on the path one after the other.
+#
+# The workers test for goals when generating states and report goals to the coordinating main process, which
+# broadcasts the cost of the best plan found so far (the incumbent). For A* the first plan found is not necessarily
+# optimal, since the workers do not expand states in a global f-order. Instead, workers discard every state with
+# f >= incumbent, and the search terminates once all workers are idle and no messages are in transit. As long as the
+# heuristic is admissible, the incumbent is then optimal. Termination is detected by repeatedly probing the workers for
+# their status and their number of sent and received batches: the search is over when two consecutive probes find every
+# worker idle with unchanged counters and as many batches received as sent. Since an idle worker can only become busy
+# by receiving a batch, nothing can have happened in between the two probes.
+#
+# Greedy search instead stops as soon as any plan is found, and without a heuristic the states are expanded in order
+# of their path cost, which returns a plan of minimal length just like BFS.
+#
+# The workers are forked from the main process, such that they share the preprocessed level and heuristic without
+# having to serialize them. This requires the 'fork' start method, which is not available on Windows.
+
+# The number of states collected for a worker before they are sent as one batch
+BATCH_SIZE = 256
+# The number of states a worker expands between checking its inbox and flushing all of its batches
+EXPANSIONS_PER_POLL = 64
+# The number of seconds between probes for termination by the main process
+PROBE_INTERVAL = 0.02
+
+
+def is_supported() -> bool:
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+class HDAStarWorker:
+
+    def __init__(self, index, num_workers, level, action_set, goal_description, heuristic, greedy, inboxes, results,
+                 max_memory_usage):
+        self.index = index
+        self.num_workers = num_workers
+        self.level = level
+        self.action_set = action_set
+        self.goal_description = goal_description
+        self.heuristic = heuristic
+        self.greedy = greedy
+        self.inboxes = inboxes
+        self.results = results
+        # The budget is checked once per EXPANSIONS_PER_POLL expansions
+        self.memory_budget = memory.MemoryBudget(max_memory_usage, check_interval=16)
+
+        self.open = BucketPriorityQueue()
+        # Maps the key of every stored state into a (path cost, h, parent key, joint action names) tuple
+        self.nodes = {}
+        self.outboxes = [[] for _ in range(num_workers)]
+        self.incumbent = APPROX_INFINITY
+        self.num_sent = 0
+        self.num_received = 0
+        self.num_expanded = 0
+        self.num_generated = 0
+        self.stopped = False
+        # The worker is constructed in its own process, so each worker writes its own records
+        self.search_telemetry = telemetry.SearchTelemetry(f'hda_star_worker_{index}')
+
+    def run(self):
+        inbox = self.inboxes[self.index]
+        while not self.stopped:
+            if self.open.size() > 0:
+                self.receive_all()
+                for _ in range(EXPANSIONS_PER_POLL):
+                    if self.open.size() == 0 or self.stopped:
+                        break
+                    self.expand_next()
+                self.flush()
+                if self.memory_budget.check(len(self.nodes)) == memory.MEMORY_EXCEEDED:
+                    self.results.put(('failed', self.index, 'Maximum memory usage exceeded!'))
+                    self.open.clear()
+            else:
+                # Nothing to do until a message arrives
+                self.flush()
+                self.receive(inbox.get())
+                self.receive_all()
+
+        # Do not wait for undelivered batches to be read by workers which have already stopped
+        for other_inbox in self.inboxes:
+            other_inbox.cancel_join_thread()
+
+    def receive_all(self):
+        inbox = self.inboxes[self.index]
+        while not self.stopped:
+            try:
+                message = inbox.get_nowait()
+            except queue.Empty:
+                return
+            self.receive(message)
+
+    def receive(self, message):
+        kind = message[0]
+        if kind == 'states':
+            self.num_received += 1
+            for node in message[1]:
+                self.insert(*node)
+        elif kind == 'incumbent':
+            self.incumbent = min(self.incumbent, message[1])
+        elif kind == 'probe':
+            self.flush()
+            is_idle = self.open.size() == 0
+            self.results.put(('status', self.index, message[1], is_idle, self.num_sent, self.num_received))
+        elif kind == 'trace':
+            key = message[1]
+            _, _, parent_key, action_names = self.nodes[key]
+            self.results.put(('parent', key, parent_key, action_names))
+        elif kind == 'stop':
+            self.results.put(('stopped', self.index, self.num_expanded, self.num_generated))
+            self.stopped = True
+
+    def insert(self, key: bytes, g: int, h: int, parent_key: bytes, action_names: tuple):
+        if g + h >= self.incumbent and not self.greedy:
+            return
+        node = self.nodes.get(key)
+        if node is not None and node[0] <= g:
+            return
+        # New states and states reached by a cheaper path are (re)opened
+        self.nodes[key] = (g, h, parent_key, action_names)
+        priority = h if self.greedy else g + h
+        tie_break = g if self.greedy else h
+        if self.open.contains(key):
+            self.open.change_priority(key, priority, tie_break)
+        else:
+            self.open.add(key, priority, tie_break)
+
+    def expand_next(self):
+        key = self.open.pop()
+        g, h, _, _ = self.nodes[key]
+        if g + h >= self.incumbent and not self.greedy:
+            # Every remaining state is at least as expensive, so none of them can lead to a cheaper plan
+            self.open.clear()
+            return
+
+        state = h_state.CompactHospitalState(self.level, key).unpack()
+        state.path_cost = g
+        self.num_expanded += 1
+        if self.num_expanded == self.search_telemetry.next_record:
+            self.search_telemetry.record(self.num_expanded, self.num_expanded, self.num_generated, self.open.size(),
+                                         len(self.nodes))
+        for joint_action in state.iter_applicable_actions(self.action_set):
+            child = state.result(joint_action)
+            self.num_generated += 1
+            action_names = tuple(action.name for action in joint_action)
+            if self.goal_description.is_goal(child):
+                if g + 1 < self.incumbent:
+                    self.incumbent = g + 1
+                    self.results.put(('goal', g + 1, key, action_names))
+                if self.greedy:
+                    self.open.clear()
+                    return
+                continue
+
+            child_h = self.heuristic.h(child, self.goal_description) if self.heuristic is not None else 0
+            if child_h >= APPROX_INFINITY:
+                continue
+            child_key = h_state.CompactHospitalState.pack(child)
+            owner = child.zobrist_hash % self.num_workers
+            if owner == self.index:
+                self.insert(child_key, g + 1, child_h, key, action_names)
+            else:
+                outbox = self.outboxes[owner]
+                outbox.append((child_key, g + 1, child_h, key, action_names))
+                if len(outbox) >= BATCH_SIZE:
+                    self.send(owner)
+
+    def send(self, owner: int):
+        self.inboxes[owner].put(('states', self.outboxes[owner]))
+        self.outboxes[owner] = []
+        self.num_sent += 1
+
+    def flush(self):
+        for owner in range(self.num_workers):
+            if self.outboxes[owner]:
+                self.send(owner)
+
+
+def run_worker(*worker_arguments):
+    HDAStarWorker(*worker_arguments).run()
+
+
+def hda_star(
+        initial_state:      h_state.HospitalState,
+        action_set:         list[list[actions.AnyAction]],
+        goal_description:   h_goal_description.HospitalGoalDescription,
+        heuristic,
+        greedy:             bool,
+        num_workers:        int,
+        statistics:         dict = None
+    ) -> tuple[bool, list[list[actions.AnyAction]]]:
+    """
+    Searches for a plan using num_workers worker processes and returns a (boolean, plan) pair just like graph_search.
+    The states are ordered by f = g + h (or by h if greedy is True), where the heuristic may be None to order them by
+    path cost. If a dictionary is given as statistics, the number of expanded and generated states per worker and the
+    search time are stored in it.
+    """
+    start_time = time.time()
+    if isinstance(initial_state, h_state.CompactHospitalState):
+        initial_state = initial_state.unpack()
+    level = initial_state.level
+    initial_state.parent = None
+    initial_state.path_cost = 0
+    if goal_description.is_goal(initial_state):
+        return True, []
+    initial_h = heuristic.h(initial_state, goal_description) if heuristic is not None else 0
+    if initial_h >= APPROX_INFINITY:
+        return False, []
+
+    context = multiprocessing.get_context('fork')
+    inboxes = [context.Queue() for _ in range(num_workers)]
+    results = context.Queue()
+    # Make sure that the workers do not inherit (and later flush) any buffered messages to the server
+    sys.stdout.flush()
+    sys.stderr.flush()
+    workers = [context.Process(target=run_worker, daemon=True,
+                               args=(index, num_workers, level, action_set, goal_description, heuristic, greedy,
+                                     inboxes, results, memory.max_usage / num_workers))
+               for index in range(num_workers)]
+    for worker in workers:
+        worker.start()
+
+    def owner_of(key):
+        return h_state.CompactHospitalState(level, key).unpack().zobrist_hash % num_workers
+
+    initial_key = h_state.CompactHospitalState.pack(initial_state)
+    inboxes[owner_of(initial_key)].put(('states', [(initial_key, 0, initial_h, None, None)]))
+    num_sent = 1
+
+    # Wait for the workers to find a plan and (unless greedy) to run out of cheaper states
+    incumbent = APPROX_INFINITY
+    goal_parent = None
+    failed = False
+    wave = 0
+    is_probing = False
+    replies = {}
+    previous_replies = None
+    last_probe_time = 0
+    while True:
+        if not is_probing and time.time() - last_probe_time >= PROBE_INTERVAL:
+            wave += 1
+            is_probing = True
+            last_probe_time = time.time()
+            replies = {}
+            for inbox in inboxes:
+                inbox.put(('probe', wave))
+        try:
+            message = results.get(timeout=PROBE_INTERVAL)
+        except queue.Empty:
+            continue
+
+        kind = message[0]
+        if kind == 'goal':
+            _, cost, parent_key, action_names = message
+            if cost < incumbent:
+                incumbent = cost
+                goal_parent = (parent_key, action_names)
+                print(f"HDA*: found plan of length {cost} after {time.time() - start_time:.3f} s", file=sys.stderr,
+                      flush=True)
+                if greedy:
+                    break
+                for inbox in inboxes:
+                    inbox.put(('incumbent', cost))
+        elif kind == 'failed':
+            print(f"HDA*: worker {message[1]} failed: {message[2]}", file=sys.stderr, flush=True)
+            failed = True
+            break
+        elif kind == 'status' and message[2] == wave:
+            _, index, _, is_idle, worker_sent, worker_received = message
+            replies[index] = (is_idle, worker_sent, worker_received)
+            if len(replies) < num_workers:
+                continue
+            current_replies = [replies[index] for index in range(num_workers)]
+            is_quiet = all(is_idle for (is_idle, _, _) in current_replies) and \
+                num_sent + sum(sent for (_, sent, _) in current_replies) == \
+                sum(received for (_, _, received) in current_replies)
+            if is_quiet and current_replies == previous_replies:
+                break
+            previous_replies = current_replies if is_quiet else None
+            is_probing = False
+            # Confirm a quiet probe right away
+            if is_quiet:
+                last_probe_time = 0
+
+    # Follow the parent keys back to the initial state
+    plan = None
+    if goal_parent is not None and not failed:
+        key, action_names = goal_parent
+        named_plan = [action_names]
+        while True:
+            inboxes[owner_of(key)].put(('trace', key))
+            while True:
+                message = results.get()
+                if message[0] == 'parent' and message[1] == key:
+                    break
+            _, _, key, action_names = message
+            if key is None:
+                break
+            named_plan.append(action_names)
+        named_plan.reverse()
+        plan = plan_from_action_names(named_plan, action_set)
+
+    # Stop the workers and collect their statistics
+    for inbox in inboxes:
+        inbox.put(('stop',))
+    num_expanded = [0] * num_workers
+    num_generated = [0] * num_workers
+    num_stopped = 0
+    while num_stopped < num_workers:
+        message = results.get()
+        if message[0] == 'stopped':
+            _, index, num_expanded[index], num_generated[index] = message
+            num_stopped += 1
+    for worker in workers:
+        worker.join(timeout=1)
+        if worker.is_alive():
+            worker.terminate()
+    for inbox in inboxes:
+        inbox.cancel_join_thread()
+
+    elapsed_time = time.time() - start_time
+    print(f"HDA*: {num_workers} workers expanded {sum(num_expanded):,d} and generated {sum(num_generated):,d} states "
+          f"in {elapsed_time:.3f} s (expanded per worker: {num_expanded})", file=sys.stderr, flush=True)
+    if statistics is not None:
+        statistics['expanded'] = num_expanded
+        statistics['generated'] = num_generated
+        statistics['time'] = elapsed_time
+
+    if plan is None:
+        return False, []
+    return True, plan
@@ -0,0 +1,114 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import sys
+import time
+import memory
+import telemetry
+
+import domains.hospital.actions as actions
+import domains.hospital.state as h_state
+import domains.hospital.goal_description as h_goal_description
+from utils import APPROX_INFINITY
+
+# Iterative deepening A* (Korf 1985) performs a series of depth-first searches, each of which only visits the states
+# with f = g + h below a threshold. The first threshold is the h-value of the initial state, and each following
+# threshold is the smallest f-value which exceeded the previous threshold, so the first plan found is optimal if the
+# heuristic is admissible. Only the current path is stored, so IDA* trades the memory of A* for re-expanding states.
+#
+# Since the state space of the hospital domain contains many transpositions (different paths to the same state), the
+# search also keeps a transposition table mapping states into the smallest path cost they have been visited with
+# during the current iteration. A state reached again with at least that path cost is skipped, since everything below
+# it has already been searched with a budget at least as large. The table is only filled while memory is available,
+# and is cleared if the memory limit is exceeded, in which case the search continues as plain IDA*.
+
+
+def ida_star(
+        initial_state:      h_state.HospitalState,
+        action_set:         list[list[actions.AnyAction]],
+        goal_description:   h_goal_description.HospitalGoalDescription,
+        heuristic
+    ) -> tuple[bool, list[list[actions.AnyAction]]]:
+    """
+    Searches for an optimal plan using IDA* with the given heuristic (or None to use h = 0) and returns a
+    (boolean, plan) pair just like graph_search.
+    """
+    start_time = time.time()
+    initial_state.parent = None
+    initial_state.path_cost = 0
+    if goal_description.is_goal(initial_state):
+        return True, []
+
+    def h(state):
+        return heuristic.h(state, goal_description) if heuristic is not None else 0
+
+    threshold = h(initial_state)
+    memory_budget = memory.MemoryBudget()
+    search_telemetry = telemetry.SearchTelemetry('ida_star')
+    num_expanded = 0
+    num_generated = 1
+    while threshold < APPROX_INFINITY:
+        transposition_table = {initial_state: 0}
+        next_threshold = APPROX_INFINITY
+        # The current path and, for each of its states, the iterator over its applicable joint actions
+        path = [initial_state]
+        successors = [initial_state.iter_applicable_actions(action_set)]
+        num_expanded += 1
+        while successors:
+            joint_action = next(successors[-1], None)
+            if joint_action is None:
+                path.pop()
+                successors.pop()
+                continue
+
+            state = path[-1]
+            child = state.result(joint_action)
+            num_generated += 1
+            g = child.path_cost
+            if transposition_table.get(child, APPROX_INFINITY) <= g:
+                continue
+            if goal_description.is_goal(child):
+                if g <= threshold:
+                    print(f"IDA*: found plan of length {g} after expanding {num_expanded} states in "
+                          f"{time.time() - start_time:.3f} s", file=sys.stderr, flush=True)
+                    return True, child.extract_plan()
+                next_threshold = min(next_threshold, g)
+                continue
+
+            child_h = h(child)
+            if child_h >= APPROX_INFINITY:
+                continue
+            f = g + child_h
+            if f > threshold:
+                next_threshold = min(next_threshold, f)
+                continue
+
+            memory_status = memory_budget.check(len(transposition_table) + len(path))
+            if memory_status == memory.MEMORY_OK:
+                transposition_table[child] = g
+            elif memory_status == memory.MEMORY_EXCEEDED and transposition_table:
+                print("IDA*: maximum memory usage exceeded, clearing the transposition table", file=sys.stderr,
+                      flush=True)
+                transposition_table.clear()
+            path.append(child)
+            successors.append(child.iter_applicable_actions(action_set))
+            num_expanded += 1
+            # The current path takes the place of the frontier and the transposition table that of the closed set
+            if num_expanded == search_telemetry.next_record:
+                search_telemetry.record(num_expanded, num_expanded, num_generated, len(path), len(transposition_table))
+
+        print(f"IDA*: no plan with f <= {threshold}, expanded {num_expanded} states in "
+              f"{time.time() - start_time:.3f} s", file=sys.stderr, flush=True)
+        threshold = next_threshold
+
+    return False, []
@@ -0,0 +1,180 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import sys
+from typing import Callable
+
+import domains.hospital.actions as actions
+import domains.hospital.state as h_state
+import domains.hospital.goal_description as h_goal_description
+from search_algorithms.operator_decomposition import OperatorDecompositionNode, OperatorDecompositionGoalDescription
+from utils import GenericNoOp
+
+# Independence detection (Standley 2010) avoids searching the full joint state space when groups of agents do not
+# interact. Initially every color forms its own group, consisting of the agents and boxes of that color, since agents
+# of the same color may need to cooperate on the same boxes. Each group is then planned for separately, ignoring all
+# other groups, and the group plans are merged and simulated from the initial state. Whenever the actions of two
+# groups conflict, the two groups are merged into a single group and replanned together. This continues until the
+# merged plan is conflict free, which in the worst case means that all agents end up in a single group.
+#
+# Boxes of colors without any agents can never be moved, so they are kept as obstacles in every group.
+#
+# The groups are searched in the same form as the full problem: with operator decomposition (see classic_agent_type)
+# the initial state and goal description of each group are wrapped for operator decomposition as well, and with compact
+# states (-compact) the initial state of each group is a CompactHospitalState.
+
+
+def independence_detection(
+        initial_state:      h_state.HospitalState,
+        action_set:         list[list[actions.AnyAction]],
+        goal_description:   h_goal_description.HospitalGoalDescription,
+        group_search:       Callable
+    ) -> tuple[bool, list[list[actions.AnyAction]]]:
+    """
+    Computes a joint plan using independence detection, where group_search(state, action_set, goal_description) is
+    used to compute the plan of each group and must return a (boolean, plan) pair just like graph_search.
+    """
+    # Unwrap the full problem, remembering how to wrap the problems of the groups
+    use_operator_decomposition = isinstance(initial_state, OperatorDecompositionNode)
+    if use_operator_decomposition:
+        initial_state = initial_state.state
+        goal_description = goal_description.goal_description
+    use_compact_states = isinstance(initial_state, h_state.CompactHospitalState)
+    if use_compact_states:
+        initial_state = initial_state.unpack()
+
+    level = initial_state.level
+    agent_colors = [level.colors[agent_char] for (_, agent_char) in initial_state.agent_positions]
+    groups = []
+    for color in agent_colors:
+        if frozenset([color]) not in groups:
+            groups.append(frozenset([color]))
+
+    group_plans = {}
+    while True:
+        for group in groups:
+            if group in group_plans:
+                continue
+            print(f"Independence detection: planning for group {sorted(group)}", file=sys.stderr, flush=True)
+            success, plan = plan_group(initial_state, action_set, goal_description, group, group_search,
+                                       use_operator_decomposition, use_compact_states)
+            if not success:
+                return False, []
+            group_plans[group] = plan
+
+        plan, conflicting_groups = merge_group_plans(initial_state, goal_description, groups, group_plans)
+        if conflicting_groups is None:
+            print(f"Independence detection: found a conflict free plan using {len(groups)} group(s)", file=sys.stderr)
+            return True, plan
+        if len(groups) == 1:
+            # Should not happen since the single group is planned for in the full state
+            print("Independence detection: the plan of the single remaining group is invalid", file=sys.stderr)
+            return False, []
+
+        # Merge the conflicting groups and replan them together
+        merged_group = frozenset().union(*conflicting_groups)
+        print(f"Independence detection: merging groups {[sorted(group) for group in conflicting_groups]}",
+              file=sys.stderr, flush=True)
+        groups = [group for group in groups if group not in conflicting_groups] + [merged_group]
+
+
+def group_agent_indices(initial_state, group: frozenset) -> list[int]:
+    colors = initial_state.level.colors
+    return [agent_index for (agent_index, (_, agent_char)) in enumerate(initial_state.agent_positions)
+            if colors[agent_char] in group]
+
+
+def plan_group(initial_state, action_set, goal_description, group: frozenset, group_search: Callable,
+               use_operator_decomposition: bool = False, use_compact_states: bool = False):
+    """
+    Plans for the agents of the group, ignoring all agents and movable boxes of other groups. The initial state and
+    goal description of the group are wrapped for operator decomposition and compact states if requested.
+    """
+    level = initial_state.level
+    agent_indices = group_agent_indices(initial_state, group)
+    agent_colors = {level.colors[agent_char] for (_, agent_char) in initial_state.agent_positions}
+
+    def is_relevant(char):
+        return level.colors[char] in group or level.colors[char] not in agent_colors
+
+    group_state = h_state.HospitalState(
+        level,
+        [initial_state.agent_positions[agent_index] for agent_index in agent_indices],
+        [(box_position, box_char) for (box_position, box_char) in initial_state.box_positions if is_relevant(box_char)]
+    )
+    group_goal_description = goal_description.create_new_goal_description_of_same_type(
+        [goal for goal in goal_description.goals if is_relevant(goal[1])])
+    group_action_set = [action_set[agent_index] for agent_index in agent_indices]
+    if use_compact_states:
+        group_state = h_state.CompactHospitalState.from_state(group_state)
+    if use_operator_decomposition:
+        group_state = OperatorDecompositionNode(group_state)
+        group_goal_description = OperatorDecompositionGoalDescription(group_goal_description)
+    return group_search(group_state, group_action_set, group_goal_description)
+
+
+def merge_group_plans(initial_state, goal_description, groups: list[frozenset], group_plans: dict):
+    """
+    Merges the plans of all groups into a single joint plan and simulates it from the initial state.
+    Returns (plan, None) if the merged plan is valid and (None, conflicting_groups) otherwise.
+    Groups which have completed their plans perform NoOps.
+    """
+    level = initial_state.level
+    num_agents = len(initial_state.agent_positions)
+    agent_groups = [None] * num_agents
+    for group in groups:
+        for agent_index in group_agent_indices(initial_state, group):
+            agent_groups[agent_index] = group
+
+    no_op = GenericNoOp()
+    plan_length = max(len(plan) for plan in group_plans.values())
+    plan = [[no_op] * num_agents for _ in range(plan_length)]
+    for group in groups:
+        for (group_agent_index, agent_index) in enumerate(group_agent_indices(initial_state, group)):
+            for (t, group_joint_action) in enumerate(group_plans[group]):
+                plan[t][agent_index] = group_joint_action[group_agent_index]
+
+    state = initial_state
+
+    def group_of_object_at(position):
+        char = state.object_at(position)
+        return next((group for group in groups if char != '' and level.colors[char] in group), None)
+
+    for joint_action in plan:
+        # Remember which group claimed each destination and moved box, such that conflicts can be attributed
+        destinations = {}
+        active_boxes = {}
+        for (agent_index, action) in enumerate(joint_action):
+            group = agent_groups[agent_index]
+            action_destinations, action_boxes = action.conflicts(agent_index, state)
+            if not action.is_applicable(agent_index, state) and action is not no_op:
+                # The action is blocked by an object of another group at one of its destinations
+                for destination in action_destinations:
+                    blocking_group = group_of_object_at(destination)
+                    if blocking_group is not None and blocking_group != group:
+                        return None, [group, blocking_group]
+                # We cannot tell which group caused the problem, so we fall back to merging all groups
+                return None, groups
+            for destination in action_destinations:
+                if destinations.get(destination, group) != group:
+                    return None, [group, destinations[destination]]
+                destinations[destination] = group
+            for box in action_boxes:
+                if active_boxes.get(box, group) != group:
+                    return None, [group, active_boxes[box]]
+                active_boxes[box] = group
+        state = state.result(joint_action)
+
+    if not goal_description.is_goal(state):
+        return None, groups
+    return plan, None
@@ -0,0 +1,117 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import random
+
+
+class OperatorDecompositionNode:
+    """
+    OperatorDecompositionNode is a wrapper class which allows GRAPH-SEARCH to perform operator decomposition, i.e.
+    instead of expanding all joint actions of a state at once, the agents are assigned their actions one at a time.
+    A node therefore consists of a (full) state together with the actions assigned to the first agents so far:
+    - If no actions are assigned, the node is a *full* node which represents the state itself.
+    - Otherwise, the node is an *intermediate* node where the remaining agents have yet to act. Once the last agent is
+      assigned an action, the joint action is applied to the state and a new full node is created.
+    This keeps the branching factor of each node at the number of actions of a single agent rather than exponential in
+    the number of agents.
+
+    Only full nodes can be goals (see OperatorDecompositionGoalDescription) and only the joint actions of full nodes
+    are part of the plan returned by extract_plan. Intermediate nodes have the same path cost as the full node they
+    extend, so heuristics computed on the underlying state remain admissible.
+    All other attributes, e.g. agent_positions or agent_at, are looked up on the underlying state.
+    """
+
+    def __init__(self, state, assigned_actions: tuple = (), parent = None, action = None):
+        self.state = state
+        self.assigned_actions = assigned_actions
+        self.parent = parent
+        # The joint action leading to this node, which is only set for full nodes
+        self.action = action
+        if parent is None:
+            self.path_cost = 0
+        else:
+            self.path_cost = parent.path_cost + (1 if action is not None else 0)
+
+    def is_full(self) -> bool:
+        return len(self.assigned_actions) == 0
+
+    def get_applicable_actions(self, action_set):
+        """
+        Returns the applicable actions of the next agent, i.e. the actions applicable in the underlying state which do
+        not conflict with the actions already assigned to the previous agents.
+        """
+        agent_index = len(self.assigned_actions)
+        applicable_actions = []
+        for action in action_set[agent_index]:
+            if action.is_applicable(agent_index, self.state) and \
+                    not self.state.is_conflicting(self.assigned_actions + (action,)):
+                applicable_actions.append(action)
+        random.shuffle(applicable_actions)
+        return applicable_actions
+
+    def result(self, action):
+        """Assigns the action to the next agent and returns the resulting (intermediate or full) node"""
+        assigned_actions = self.assigned_actions + (action,)
+        if len(assigned_actions) < len(self.state.agent_positions):
+            return OperatorDecompositionNode(self.state, assigned_actions, self)
+        return OperatorDecompositionNode(self.state.result(assigned_actions), (), self, assigned_actions)
+
+    def extract_plan(self):
+        """Extracts the plan of joint actions by walking backwards through the full nodes of the search tree"""
+        reverse_plan = []
+        current_node = self
+        while current_node.parent is not None:
+            if current_node.action is not None:
+                reverse_plan.append(current_node.action)
+            current_node = current_node.parent
+        reverse_plan.reverse()
+        return reverse_plan
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the node itself, which we then look up on the underlying state
+        return getattr(self.state, name)
+
+    def __repr__(self):
+        return f"{self.state}\nAssigned actions: {list(self.assigned_actions)}"
+
+    def __eq__(self, other):
+        if isinstance(other, self.__class__):
+            return self.assigned_actions == other.assigned_actions and self.state == other.state
+        else:
+            return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.state, self.assigned_actions))
+
+
+class OperatorDecompositionGoalDescription:
+    """
+    OperatorDecompositionGoalDescription is a wrapper class around a goal description which ensures that only full
+    OperatorDecompositionNodes, i.e. nodes where all agents have acted, are recognized as goals.
+    All other attributes are looked up on the wrapped goal description, such that heuristics can use it as usual.
+    """
+
+    def __init__(self, goal_description):
+        self.goal_description = goal_description
+
+    def is_goal(self, node):
+        return node.is_full() and self.goal_description.is_goal(node.state)
+
+    def __getattr__(self, name):
+        return getattr(self.goal_description, name)
+
+    def __repr__(self):
+        return repr(self.goal_description)
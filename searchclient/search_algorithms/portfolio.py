@@ -0,0 +1,118 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import multiprocessing
+import multiprocessing.connection
+import sys
+import time
+import traceback
+import memory
+from typing import Callable
+
+import domains.hospital.actions as actions
+import domains.hospital.state as h_state
+import domains.hospital.goal_description as h_goal_description
+from utils import plan_from_action_names
+
+# A portfolio runs several search configurations (e.g. BFS, A* and greedy search with different heuristics) at the same
+# time, each in its own process forked from the main process, since it is rarely known in advance which configuration
+# solves a given level in time. Each process sends its result back through its own pipe as lists of action names, such
+# that the losing processes can be killed at any time without corrupting a shared queue.
+#
+# Without a deadline, the first plan found wins. With a deadline, the portfolio waits until the deadline (or until all
+# configurations have finished) and picks the shortest plan found. If no plan has been found by then, the first plan
+# found afterwards wins.
+#
+# The --max-memory limit is split evenly between the configurations. Like the parallel search, the portfolio requires
+# the 'fork' start method, which is not available on Windows.
+
+
+def run_configuration(search: Callable, initial_state, action_set, goal_description, connection, max_memory_usage):
+    memory.max_usage = max_memory_usage
+    try:
+        success, plan = search(initial_state, action_set, goal_description)
+        connection.send((success, [[action.name for action in joint_action] for joint_action in plan]))
+    except Exception as e:
+        print(f"Portfolio: configuration failed: {e!r}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        sys.stderr.flush()
+        connection.send((False, []))
+    connection.close()
+
+
+def portfolio_search(
+        initial_state:      h_state.HospitalState,
+        action_set:         list[list[actions.AnyAction]],
+        goal_description:   h_goal_description.HospitalGoalDescription,
+        configurations:     list[tuple[str, Callable]],
+        deadline:           float = None
+    ) -> tuple[bool, list[list[actions.AnyAction]]]:
+    """
+    Runs the searches of the given (name, search) configurations in parallel, where search(state, action_set,
+    goal_description) must return a (boolean, plan) pair just like graph_search, and returns the winning plan.
+    The deadline is given in seconds from now, or None to return the first plan found.
+    """
+    start_time = time.time()
+    context = multiprocessing.get_context('fork')
+    # Make sure that the configurations do not inherit (and later flush) any buffered messages to the server
+    sys.stdout.flush()
+    sys.stderr.flush()
+    max_memory_usage = memory.max_usage / len(configurations)
+    processes = {}
+    names = {}
+    for (name, search) in configurations:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=run_configuration, daemon=True,
+                                  args=(search, initial_state, action_set, goal_description, sender, max_memory_usage))
+        process.start()
+        sender.close()
+        processes[receiver] = process
+        names[receiver] = name
+
+    best_name = None
+    best_plan = None
+    pending = list(processes)
+    while pending:
+        remaining_time = None if deadline is None else start_time + deadline - time.time()
+        if best_plan is not None and (remaining_time is None or remaining_time <= 0):
+            break
+        # Until the deadline, wait for more plans, and afterwards only for the first plan
+        timeout = remaining_time if remaining_time is not None and remaining_time > 0 else None
+        ready = multiprocessing.connection.wait(pending, timeout)
+        for receiver in ready:
+            pending.remove(receiver)
+            try:
+                success, named_plan = receiver.recv()
+            except EOFError:
+                # The process died without sending a result
+                success, named_plan = False, []
+            elapsed_time = time.time() - start_time
+            if not success:
+                print(f"Portfolio: {names[receiver]} failed after {elapsed_time:.3f} s", file=sys.stderr, flush=True)
+                continue
+            print(f"Portfolio: {names[receiver]} found a plan of length {len(named_plan)} after {elapsed_time:.3f} s",
+                  file=sys.stderr, flush=True)
+            if best_plan is None or len(named_plan) < len(best_plan):
+                best_name, best_plan = names[receiver], named_plan
+
+    # Kill the configurations which are still searching
+    for (receiver, process) in processes.items():
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        receiver.close()
+
+    if best_plan is None:
+        return False, []
+    print(f"Portfolio: using the plan of {best_name}", file=sys.stderr, flush=True)
+    return True, plan_from_action_names(best_plan, action_set)
@@ -0,0 +1,207 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+import heapq
+import itertools
+import sys
+import time
+import memory
+import telemetry
+
+import domains.hospital.actions as actions
+import domains.hospital.state as h_state
+import domains.hospital.goal_description as h_goal_description
+from utils import APPROX_INFINITY
+
+# Simplified memory-bounded A* (Russell 1992) behaves like A* until the memory is full, after which it makes room for
+# new nodes by forgetting the leaves of the search tree with the highest f-values. The f-value of a forgotten node is
+# remembered by its parent, such that the parent knows how good the forgotten subtree is and regenerates it only when
+# it becomes the most promising part of the search tree again.
+#
+# Every node keeps a heap of its successors which are not currently in memory, each stored as an (f bound, joint
+# action) pair. A node is in the open list as long as this heap is non-empty, with the smallest bound as its priority.
+# Expanding a node generates only its most promising missing successor, whose f-value is at least the bound (pathmax).
+# Forgetting a leaf puts its own priority back into the heap of its parent as the bound of the forgotten successor.
+# Dead ends are forgotten with an infinite bound right away, so that the infinite bounds propagate towards the root,
+# and the search fails once the best bound in the open list is infinite.
+#
+# The open list orders nodes by lowest priority, preferring deeper nodes, while the nodes are forgotten in order of
+# highest priority, preferring shallower nodes. Both are heaps with lazy deletion, where entries of a node are only
+# valid if they were pushed with the current version of the node.
+#
+# The memory available is taken from the --max-memory limit: once the memory usage gets close to the limit (see
+# memory.MemoryBudget), the number of nodes in memory at that point becomes the maximum. Nodes whose path fills the
+# memory on its own can never lead to a plan which fits in memory, so they are treated as dead ends. The plan is optimal
+# as long as the heuristic is admissible and the memory suffices to store an optimal path.
+#
+# Duplicates are detected using a table of the lowest path cost found for each state and the node reached by it. A
+# successor reached by a more expensive path, or by an equally expensive path while the node of the table is still in
+# memory, is treated as a dead end, since the subtree of the cheaper node (or, once forgotten, the bound remembered by
+# its parent) already covers every plan through the state. The table grows until the memory is getting low or the first
+# node is forgotten, after which only the states already in the table and the cycles along the path to the root are
+# detected.
+
+# Marks the successor heap entry of a goal node, such that the node is only returned when it is selected for expansion
+GOAL = None
+
+
+class SMAStarNode:
+
+    __slots__ = ('state', 'parent', 'action', 'depth', 'successors', 'num_children', 'version')
+
+    def __init__(self, state: h_state.HospitalState, parent, action, depth: int):
+        self.state = state
+        self.parent = parent
+        self.action = action
+        self.depth = depth
+        # Heap of (f bound, tie breaker, joint action) for the successors which are not in memory
+        self.successors = []
+        self.num_children = 0
+        self.version = 0
+
+    def priority(self) -> int:
+        return self.successors[0][0] if self.successors else APPROX_INFINITY
+
+    def is_ancestor_state(self, state) -> bool:
+        node = self
+        while node is not None:
+            if node.state == state:
+                return True
+            node = node.parent
+        return False
+
+
+def sma_star(
+        initial_state:      h_state.HospitalState,
+        action_set:         list[list[actions.AnyAction]],
+        goal_description:   h_goal_description.HospitalGoalDescription,
+        heuristic,
+        max_nodes:          int = None
+    ) -> tuple[bool, list[list[actions.AnyAction]]]:
+    """
+    Searches for an optimal plan using SMA* with the given heuristic (or None to use h = 0) and returns a
+    (boolean, plan) pair just like graph_search. The maximum number of nodes in memory is determined by the memory
+    limit unless max_nodes is given.
+    """
+    start_time = time.time()
+    initial_state.parent = None
+    initial_state.path_cost = 0
+
+    def h(state):
+        return heuristic.h(state, goal_description) if heuristic is not None else 0
+
+    counter = itertools.count()
+    open_nodes = []
+    leaves = []
+
+    def update(node):
+        """Pushes new entries of the node into the open list and the leaves after its successors or children changed"""
+        node.version += 1
+        if node.successors:
+            heapq.heappush(open_nodes, (node.priority(), -node.depth, next(counter), node.version, node))
+        if node.num_children == 0 and node.parent is not None:
+            heapq.heappush(leaves, (-node.priority(), node.depth, next(counter), node.version, node))
+
+    def set_successors(node, f):
+        if goal_description.is_goal(node.state):
+            node.successors = [(f, next(counter), GOAL)]
+        else:
+            node.successors = [(f, next(counter), joint_action)
+                               for joint_action in node.state.iter_applicable_actions(action_set)]
+
+    def forget(node, bound):
+        """Removes a leaf from memory and lets its parent remember the given bound for it"""
+        node.version = -1
+        best_depth, best_node = best_nodes.get(node.state, (None, None))
+        if best_node is node:
+            best_nodes[node.state] = (best_depth, None)
+        parent = node.parent
+        heapq.heappush(parent.successors, (bound, next(counter), node.action))
+        parent.num_children -= 1
+        update(parent)
+
+    root = SMAStarNode(initial_state, None, None, 0)
+    set_successors(root, h(initial_state))
+    update(root)
+    # Maps each state into the lowest depth found for it and the node of that depth, or None once it is forgotten
+    best_nodes = {initial_state: (0, root)}
+    is_table_growing = True
+    num_nodes = 1
+    num_expanded = 0
+    num_forgotten = 0
+    memory_budget = memory.MemoryBudget()
+    search_telemetry = telemetry.SearchTelemetry('sma_star')
+
+    while open_nodes:
+        if max_nodes is None and memory_budget.check(num_nodes) != memory.MEMORY_OK:
+            max_nodes = num_nodes
+            is_table_growing = False
+            print(f"SMA*: memory is getting low, keeping at most {max_nodes} nodes in memory", file=sys.stderr,
+                  flush=True)
+
+        _, _, _, version, node = heapq.heappop(open_nodes)
+        if version != node.version or not node.successors:
+            continue
+        bound, _, joint_action = heapq.heappop(node.successors)
+        if bound >= APPROX_INFINITY:
+            break
+        if joint_action is GOAL:
+            print(f"SMA*: found plan of length {node.depth} after {num_expanded} expansions, forgetting "
+                  f"{num_forgotten} nodes, in {time.time() - start_time:.3f} s", file=sys.stderr, flush=True)
+            return True, node.state.extract_plan()
+
+        num_expanded += 1
+        # Every expansion generates a single successor, and the nodes in memory take the place of the frontier and the
+        # duplicate table that of the closed set
+        if num_expanded == search_telemetry.next_record:
+            search_telemetry.record(num_expanded, num_expanded, num_expanded + 1, num_nodes, len(best_nodes))
+        child_state = node.state.result(joint_action)
+        child = SMAStarNode(child_state, node, joint_action, node.depth + 1)
+        best_depth, best_node = best_nodes.get(child_state, (APPROX_INFINITY, None))
+        is_duplicate = best_depth < child.depth or (best_depth == child.depth and best_node is not None)
+        child_h = APPROX_INFINITY if is_duplicate or node.is_ancestor_state(child_state) else h(child_state)
+        if child_h < APPROX_INFINITY:
+            set_successors(child, max(bound, child.depth + child_h))
+        if max_nodes is not None and child.depth >= max_nodes - 1 and \
+                (not child.successors or child.successors[0][2] is not GOAL):
+            # The path to the child fills the memory, so no plan through the child can be stored
+            child.successors = []
+        if not child.successors:
+            # Cycles, dead ends and too deep nodes are never worth remembering
+            heapq.heappush(node.successors, (APPROX_INFINITY, next(counter), joint_action))
+            update(node)
+            continue
+        if is_table_growing or child_state in best_nodes:
+            best_nodes[child_state] = (child.depth, child)
+        node.num_children += 1
+        num_nodes += 1
+        update(node)
+        update(child)
+
+        # Make room by forgetting the worst leaves, but never the most promising node
+        while max_nodes is not None and num_nodes > max_nodes and leaves:
+            _, _, _, version, leaf = leaves[0]
+            if version != leaf.version or leaf.num_children > 0:
+                heapq.heappop(leaves)
+                continue
+            if leaf is child:
+                break
+            heapq.heappop(leaves)
+            forget(leaf, leaf.priority())
+            num_nodes -= 1
+            num_forgotten += 1
+            is_table_growing = False
+
+    print(f"SMA*: no plan found after {num_expanded} expansions in {time.time() - start_time:.3f} s", file=sys.stderr,
+          flush=True)
+    return False, []
@@ -11,41 +11,81 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
+
+# Taken before anything else is imported, such that the startup profile includes the time spent importing modules
+start_time = time.perf_counter()
+
 import argparse
 import memory
 import re
 import sys
-from agent_types.classic import classic_agent_type
-from agent_types.decentralised import decentralised_agent_type
-from agent_types.helper import helper_agent_type
-from agent_types.non_deterministic import non_deterministic_agent_type
-from agent_types.goal_recognition import goal_recognition_agent_type
-from agent_types.robot import robot_agent_type
-from domains.hospital import *
-from strategies.bfs import FrontierBFS
-from strategies.dfs import FrontierDFS
-from strategies.bestfirst import FrontierAStar, FrontierGreedy
-from robot_interface import *
+import telemetry
+from startup_profile import StartupProfile
 
-from utils import read_line
+# The modules of the domain, strategies, heuristics, search algorithms and agent types are only imported once the
+# command line has selected them, since the server starts its timer before the searchclient is started.
 
 
 def load_level_file_from_server():
-    lines = []
-    while True:
-        line = read_line()
-        lines.append(line)
-        if line.startswith("#end"):
+    # The server sends nothing after the level until the client has sent an action, so we can read the level in as few
+    # reads as possible instead of line by line, and stop as soon as the '#end' line has arrived
+    data = bytearray()
+    while not re.search(rb'(^|\n)#end\r?\n', data):
+        chunk = sys.stdin.buffer.read1(1 << 16)
+        if not chunk:
             break
-
-    return lines
+        data += chunk
+    return [line.rstrip() for line in data.decode().splitlines()]
 
 
 def load_level_file_from_path(path):
     with open(path, "r") as f:
-        lines = f.readlines()
-        lines = list(map(lambda line: line.strip(), lines))
-        return lines
+        return [line.rstrip() for line in f.read().splitlines()]
+
+
+def construct_heuristic(heuristic_name):
+    if heuristic_name == 'goalcount':
+        from domains.hospital.heuristics import HospitalGoalCountHeuristics
+        return HospitalGoalCountHeuristics()
+    elif heuristic_name == 'advanced':
+        from domains.hospital.heuristics import HospitalAdvancedHeuristics
+        return HospitalAdvancedHeuristics()
+    elif heuristic_name == 'matching':
+        from domains.hospital.heuristics import HospitalMatchingHeuristics
+        return HospitalMatchingHeuristics()
+    elif heuristic_name == 'pdb':
+        from domains.hospital.heuristics import HospitalPatternDatabaseHeuristics
+        return HospitalPatternDatabaseHeuristics()
+    return None
+
+
+def construct_frontier(strategy_name, heuristic):
+    if strategy_name == 'bfs':
+        from strategies.bfs import FrontierBFS
+        return FrontierBFS()
+    elif strategy_name == 'dfs':
+        from strategies.dfs import FrontierDFS
+        return FrontierDFS()
+    elif strategy_name == 'astar':
+        from strategies.bestfirst import FrontierAStar
+        return FrontierAStar(heuristic)
+    elif strategy_name == 'greedy':
+        from strategies.bestfirst import FrontierGreedy
+        return FrontierGreedy(heuristic)
+    print(f"Unrecognized strategy {strategy_name}", file=sys.stderr)
+    return None
+
+
+def construct_memory_bounded_search(strategy_name, heuristic):
+    """Returns the search algorithm of a strategy which does not use GRAPH-SEARCH, or None for the other strategies"""
+    if strategy_name == 'idastar':
+        from search_algorithms.ida_star import ida_star
+        return lambda state, action_set, goal_description: ida_star(state, action_set, goal_description, heuristic)
+    elif strategy_name == 'smastar':
+        from search_algorithms.sma_star import sma_star
+        return lambda state, action_set, goal_description: sma_star(state, action_set, goal_description, heuristic)
+    return None
 
 
 def parse_command_line_arguments():
@@ -53,9 +93,30 @@ def parse_command_line_arguments():
 
     parser.add_argument('--max-memory', metavar='<GB>', type=str, default="4g",
                         help='The maximum memory usage allowed in GB (soft limit, default 4g).')
+    parser.add_argument('--cache-dir', metavar='<path>', type=str, default="",
+                        help='Store preprocessed level data (e.g. distance tables) in this directory and reuse it '
+                             'when the same level is solved again (disabled by default).')
+    parser.add_argument('--telemetry', metavar='<path or fd>', type=str, default="",
+                        help='Write search telemetry as JSON lines to this file, or to this file descriptor if it is a '
+                             'number, e.g. 2 for stderr (disabled by default).')
+    parser.add_argument('--telemetry-interval', metavar='<N>', type=int, default=telemetry.DEFAULT_INTERVAL,
+                        help=f'The number of search iterations between telemetry records (default '
+                             f'{telemetry.DEFAULT_INTERVAL}).')
+    parser.add_argument('--external-dir', metavar='<path>', type=str, default="",
+                        help='The directory in which -externalbfs stores its files (default is the temporary '
+                             'directory of the system).')
 
     parser.add_argument('-level', type=str, default="", help="Load level file directly from the file system instead of readback from the server")
     parser.add_argument('-ip', type=str, default="", help="The IP-address of the physical robot which will execute the commands when using the robot agent type")
+    parser.add_argument('-compact', action='store_true',
+                        help='Store states in a compact packed format to reduce memory usage.')
+    parser.add_argument('-operatordecomposition', action='store_true',
+                        help='Let the classic agent type assign the actions of one agent at a time during search.')
+    parser.add_argument('-startup-profile', action='store_true',
+                        help='Report how long importing modules, loading the level and preprocessing takes.')
+    parser.add_argument('-workers', metavar='<N>', type=int, default=1,
+                        help='Let the classic agent type search in parallel using HDA* with N worker processes '
+                             '(with -bfs, -astar or -greedy, default 1 which uses GRAPH-SEARCH).')
 
     strategy_group = parser.add_mutually_exclusive_group()
     strategy_group.add_argument('-bfs', action='store_const', dest='strategy', const='bfs',
@@ -66,12 +127,50 @@ def parse_command_line_arguments():
                                 help='Use the A* strategy.')
     strategy_group.add_argument('-greedy', action='store_const', dest='strategy', const='greedy',
                                 help='Use the Greedy strategy.')
+    strategy_group.add_argument('-idastar', action='store_const', dest='strategy', const='idastar',
+                                help='Use the IDA* strategy, which only stores the current path.')
+    strategy_group.add_argument('-smastar', action='store_const', dest='strategy', const='smastar',
+                                help='Use the SMA* strategy, which forgets the worst nodes when memory gets low.')
 
     heuristic_group = parser.add_mutually_exclusive_group()
     heuristic_group.add_argument('-goalcount', action='store_const', dest='heuristic', const='goalcount',
                                  help='Use a goal count heuristic.')
     heuristic_group.add_argument('-advancedheuristic', action='store_const', dest='heuristic', const='advanced',
                                  help='Use an advanced heuristic.')
+    heuristic_group.add_argument('-matchingheuristic', action='store_const', dest='heuristic', const='matching',
+                                 help='Use a heuristic based on minimum cost matchings between boxes and goals.')
+    heuristic_group.add_argument('-pdbheuristic', action='store_const', dest='heuristic', const='pdb',
+                                 help='Use the matching heuristic strengthened by pattern databases of box pairs.')
+
+    search_algorithm_group = parser.add_mutually_exclusive_group()
+    search_algorithm_group.add_argument('-cbs', action='store_const', dest='search_algorithm', const='cbs',
+                                        help='Use conflict-based search instead of GRAPH-SEARCH for the classic agent '
+                                             'type (only for levels without box goals).')
+    search_algorithm_group.add_argument('-independencedetection', action='store_const', dest='search_algorithm',
+                                        const='independencedetection',
+                                        help='Let the classic agent type plan for each color separately using '
+                                             'GRAPH-SEARCH and only merge colors whose plans conflict.')
+    search_algorithm_group.add_argument('-bidirectional', action='store_const', dest='search_algorithm',
+                                        const='bidirectional',
+                                        help='Let the classic agent type use bidirectional breadth-first search (only '
+                                             'for levels without boxes where every agent has a goal).')
+    search_algorithm_group.add_argument('-externalbfs', action='store_const', dest='search_algorithm',
+                                        const='externalbfs',
+                                        help='Let the classic agent type use breadth-first search storing the states '
+                                             'on disk instead of in memory.')
+    search_algorithm_group.add_argument('-portfolio', metavar='<configurations>', type=str, default="",
+                                        help='Let the classic agent type run several configurations in parallel and '
+                                             'use the first plan found, e.g. "bfs,astar:advanced,greedy:goalcount" '
+                                             'where each configuration is a strategy optionally followed by a '
+                                             'heuristic (goalcount, advanced, matching or pdb).')
+    parser.add_argument('-portfoliodeadline', metavar='<seconds>', type=float, default=0,
+                        help='Let the portfolio wait this long for all configurations and use the shortest plan found.')
+    search_algorithm_group.add_argument('-anytime', action='store_const', dest='search_algorithm', const='anytime',
+                                        help='Let the classic agent type use ARA*, which finds a plan quickly using '
+                                             'the heuristic and then keeps looking for shorter plans.')
+    parser.add_argument('-anytimedeadline', metavar='<seconds>', type=float, default=0,
+                        help='Let ARA* stop looking for shorter plans after this long (default is to continue until '
+                             'the plan is known to be optimal).')
 
     action_library_group = parser.add_mutually_exclusive_group()
     action_library_group.add_argument('-defaultactions', action='store_const', dest='action_library', const='default',
@@ -104,15 +203,44 @@ def parse_command_line_arguments():
     max_memory_gb = int(max_memory_gb_match.group(1))
     memory.max_usage = max_memory_gb * 1024 * 1024 * 1024
 
-    return args.strategy, args.heuristic, args.action_library, args.agent_type, args.level, args.ip
+    # Check the portfolio configurations right away, since a misspelled name would otherwise silently run another search
+    if args.portfolio:
+        for configuration in args.portfolio.split(','):
+            configuration_strategy, _, configuration_heuristic = configuration.partition(':')
+            if configuration_strategy not in ('bfs', 'dfs', 'astar', 'greedy', 'idastar', 'smastar'):
+                parser.error(f"unknown strategy '{configuration_strategy}' in the portfolio configuration "
+                             f"'{configuration}' (use bfs, dfs, astar, greedy, idastar or smastar)")
+            if configuration_heuristic not in ('', 'goalcount', 'advanced', 'matching', 'pdb'):
+                parser.error(f"unknown heuristic '{configuration_heuristic}' in the portfolio configuration "
+                             f"'{configuration}' (use goalcount, advanced, matching or pdb)")
+
+    telemetry.interval = max(1, args.telemetry_interval)
+    if args.telemetry:
+        telemetry.open_stream(args.telemetry)
+
+    return args.strategy, args.heuristic, args.action_library, args.agent_type, args.level, args.ip, args.compact, \
+        args.operatordecomposition, args.search_algorithm, args.cache_dir, args.workers, args.portfolio, \
+        args.portfoliodeadline, args.external_dir, args.anytimedeadline, args.startup_profile
 
 
 if __name__ == '__main__':
 
-    strategy_name, heuristic_name, action_library_name, agent_type_name, level_path, robot_ip = parse_command_line_arguments()
+    startup_profile = StartupProfile(start_time)
+    startup_profile.end_phase('imports', is_import=True)
+
+    strategy_name, heuristic_name, action_library_name, agent_type_name, level_path, robot_ip, use_compact_states, \
+        use_operator_decomposition, search_algorithm_name, cache_directory, num_workers, portfolio, \
+        portfolio_deadline, external_directory, anytime_deadline, use_startup_profile = parse_command_line_arguments()
+    if use_startup_profile:
+        startup_profile.enable()
+    startup_profile.end_phase('arguments')
 
     # Construct client name by removing all missing arguments and joining them together into a single string
-    name_components = [agent_type_name, strategy_name, heuristic_name, action_library_name]
+    name_components = [agent_type_name, search_algorithm_name, strategy_name, heuristic_name, action_library_name,
+                       'compact' if use_compact_states else None,
+                       'operatordecomposition' if use_operator_decomposition else None,
+                       f'{num_workers} workers' if num_workers > 1 else None,
+                       f'portfolio {portfolio}' if portfolio else None]
     client_name = " ".join(filter(lambda name: name is not None, name_components))
 
     # Send client name to server
@@ -120,6 +248,7 @@ if __name__ == '__main__':
 
     # Load the level from the server unless level path is specified
     level_lines = load_level_file_from_path(level_path) if level_path else load_level_file_from_server()
+    startup_profile.end_phase('level loading')
     # Domain name is always second line in file
     domain_name = level_lines[1]
 
@@ -134,60 +263,202 @@ if __name__ == '__main__':
     goal_description = None
     heuristic = None
     if domain_name == 'hospital':
+        from domains.hospital.actions import DEFAULT_HOSPITAL_ACTION_LIBRARY
+        from domains.hospital.goal_description import HospitalGoalDescription
+        from domains.hospital.level import HospitalLevel
+        from domains.hospital.state import HospitalState, CompactHospitalState
+
         level = HospitalLevel.parse_level_lines(level_lines)
+        if cache_directory:
+            level.attach_cache(cache_directory)
         initial_state = HospitalState(level, level.initial_agent_positions, level.initial_box_positions)
+        if use_compact_states:
+            initial_state = CompactHospitalState.from_state(initial_state)
         goal_description = HospitalGoalDescription(level, level.box_goals + level.agent_goals)
 
         # Construct the requested action library
         if action_library_name == 'default':
             action_library = DEFAULT_HOSPITAL_ACTION_LIBRARY
 
+        # The box moves available in the action library determine where boxes can get stuck
+        if action_library is not None:
+            level.can_push = any(action.name.startswith('Push') for action in action_library)
+            level.can_pull = any(action.name.startswith('Pull') for action in action_library)
+
+        startup_profile.end_phase('level parsing')
+
         # Construct the requested heuristic
-        if heuristic_name == 'goalcount':
-            heuristic = HospitalGoalCountHeuristics()
-        elif heuristic_name == 'advanced':
-            heuristic = HospitalAdvancedHeuristics()
+        heuristic = telemetry.observe_heuristic(construct_heuristic(heuristic_name))
 
     # Some heuristics needs to preprocess the level to pre-compute distance lookup tables, matchings, etc.
     if heuristic is not None:
         heuristic.preprocess(level)
-
-    # Construct the requested frontier
-    frontier = None
+    # Store the preprocessed data right away, such that it is cached even if the search does not finish
+    if level is not None:
+        level.store_cache()
+    startup_profile.end_phase('preprocessing')
 
     # If no specific strategy is requested, we implicitly assume it to be a BFS
     if strategy_name is None:
         strategy_name = 'bfs'
 
-    if strategy_name == 'bfs':
-        frontier = FrontierBFS()
-    elif strategy_name == 'dfs':
-        frontier = FrontierDFS()
-    elif strategy_name == 'astar':
-        frontier = FrontierAStar(heuristic)
-    elif strategy_name == 'greedy':
-        frontier = FrontierGreedy(heuristic)
-    else:
-        print(f"Unrecognized strategy {strategy_name}", file=sys.stderr)
+    # With a portfolio, several configurations of strategies and heuristics race each other using GRAPH-SEARCH
+    portfolio_configurations = []
+    if portfolio or num_workers > 1:
+        from search_algorithms.hda_star import hda_star, is_supported as is_hda_star_supported
+    if portfolio and not is_hda_star_supported():
+        print("Portfolios are not supported on this platform, using GRAPH-SEARCH instead", file=sys.stderr)
+    elif portfolio:
+        for configuration in portfolio.split(','):
+            configuration_strategy, _, configuration_heuristic_name = configuration.partition(':')
+            configuration_heuristic = telemetry.observe_heuristic(construct_heuristic(configuration_heuristic_name))
+            if configuration_heuristic is not None:
+                configuration_heuristic.preprocess(level)
+            if configuration_strategy in ('idastar', 'smastar') and use_operator_decomposition:
+                print(f"The {configuration_strategy} strategy does not support operator decomposition, searching the "
+                      f"full states in the {configuration} configuration", file=sys.stderr)
+
+            # The frontier is constructed by the forked process itself
+            def configuration_search(state, action_set, goal_description,
+                                     strategy=configuration_strategy, heuristic=configuration_heuristic):
+                memory_bounded_search = construct_memory_bounded_search(strategy, heuristic)
+                if memory_bounded_search is not None:
+                    # IDA* and SMA* search the full states even if the other configurations use operator decomposition
+                    if use_operator_decomposition:
+                        state, goal_description = state.state, goal_description.goal_description
+                    return memory_bounded_search(state, action_set, goal_description)
+                from search_algorithms.graph_search import graph_search
+                return graph_search(state, action_set, goal_description, construct_frontier(strategy, heuristic))
+            portfolio_configurations.append((configuration, configuration_search))
+
+    # With several workers, the searches otherwise done by GRAPH-SEARCH are done by HDA* instead
+    parallel_search = None
+    if num_workers > 1 and portfolio_configurations:
+        print("Parallel search cannot be used within a portfolio, using GRAPH-SEARCH instead", file=sys.stderr)
+    elif num_workers > 1:
+        if strategy_name in ('idastar', 'smastar'):
+            print(f"Parallel search does not support the {strategy_name} strategy, ignoring -workers", file=sys.stderr)
+        elif strategy_name not in ('bfs', 'astar', 'greedy'):
+            print(f"Parallel search does not support the {strategy_name} strategy, using GRAPH-SEARCH instead",
+                  file=sys.stderr)
+        elif use_operator_decomposition:
+            print("Parallel search does not support operator decomposition, using GRAPH-SEARCH instead",
+                  file=sys.stderr)
+        elif not is_hda_star_supported():
+            print("Parallel search is not supported on this platform, using GRAPH-SEARCH instead", file=sys.stderr)
+        else:
+            def parallel_search(state, action_set, goal_description):
+                return hda_star(state, action_set, goal_description, heuristic if strategy_name != 'bfs' else None,
+                                strategy_name == 'greedy', num_workers)
+
+    # IDA* and SMA* search on their own instead of using GRAPH-SEARCH
+    memory_bounded_search = construct_memory_bounded_search(strategy_name, heuristic)
+    if memory_bounded_search is not None and use_operator_decomposition:
+        print(f"The {strategy_name} strategy does not support operator decomposition, ignoring -operatordecomposition",
+              file=sys.stderr)
+        use_operator_decomposition = False
 
     # If no specific agent type is requested, we implicitly assume it to be the "classic" type
     if agent_type_name is None:
         agent_type_name = 'classic'
 
+    # Construct the requested frontier, but only if GRAPH-SEARCH is actually used, since the other search algorithms
+    # do not use it (and constructing an unused frontier fails as long as it is not implemented). The agent types other
+    # than the classic one always use GRAPH-SEARCH.
+    frontier = None
+    uses_graph_search = parallel_search is None and memory_bounded_search is None and not portfolio_configurations \
+        and search_algorithm_name in (None, 'independencedetection')
+    if uses_graph_search or agent_type_name != 'classic':
+        frontier = construct_frontier(strategy_name, heuristic)
+
+    # Construct the requested search algorithm, where None means GRAPH-SEARCH using the frontier
+    search_algorithm = parallel_search if parallel_search is not None else memory_bounded_search
+    if portfolio_configurations:
+        from search_algorithms.portfolio import portfolio_search
+
+        def search_algorithm(state, action_set, goal_description):
+            return portfolio_search(state, action_set, goal_description, portfolio_configurations,
+                                    portfolio_deadline if portfolio_deadline > 0 else None)
+    elif search_algorithm_name == 'cbs':
+        from search_algorithms.cbs import conflict_based_search
+        search_algorithm = conflict_based_search
+    elif search_algorithm_name == 'bidirectional':
+        from search_algorithms.bidirectional_search import bidirectional_search, \
+            is_supported as is_bidirectional_supported
+        from search_algorithms.graph_search import graph_search
+        # The frontier is only constructed if the level turns out not to be supported
+        fallback_search = search_algorithm if search_algorithm is not None else \
+            lambda *problem: graph_search(*problem, construct_frontier(strategy_name, heuristic))
+
+        def search_algorithm(state, action_set, goal_description):
+            if is_bidirectional_supported(state, action_set, goal_description):
+                return bidirectional_search(state, action_set, goal_description)
+            print("Bidirectional search only supports levels without boxes where every agent has a goal and no "
+                  "operator decomposition, using GRAPH-SEARCH instead", file=sys.stderr)
+            return fallback_search(state, action_set, goal_description)
+    elif search_algorithm_name == 'externalbfs':
+        if use_operator_decomposition:
+            print("External BFS does not support operator decomposition, ignoring -operatordecomposition",
+                  file=sys.stderr)
+            use_operator_decomposition = False
+        from search_algorithms.external_bfs import external_bfs
+
+        def search_algorithm(state, action_set, goal_description):
+            return external_bfs(state, action_set, goal_description, external_directory or None)
+    elif search_algorithm_name == 'anytime':
+        if use_operator_decomposition:
+            print("ARA* does not support operator decomposition, ignoring -operatordecomposition", file=sys.stderr)
+            use_operator_decomposition = False
+        from search_algorithms.ara_star import ara_star
+
+        def search_algorithm(state, action_set, goal_description):
+            return ara_star(state, action_set, goal_description, heuristic,
+                            anytime_deadline if anytime_deadline > 0 else None)
+    elif search_algorithm_name == 'independencedetection':
+        from search_algorithms.graph_search import graph_search
+        from search_algorithms.independence_detection import independence_detection
+        group_search = search_algorithm if search_algorithm is not None else \
+            lambda *group_problem: graph_search(*group_problem, frontier)
+
+        def search_algorithm(state, action_set, goal_description):
+            return independence_detection(state, action_set, goal_description, group_search)
+
+    startup_profile.end_phase('search setup')
+    telemetry.record_startup(startup_profile.phases)
+
     # Run the requested agent type
     if agent_type_name == 'classic':
-        classic_agent_type(level, initial_state, action_library, goal_description, frontier)
+        from agent_types.classic import classic_agent_type
+        startup_profile.end_phase('agent type import')
+        startup_profile.report()
+        classic_agent_type(level, initial_state, action_library, goal_description, frontier,
+                           use_operator_decomposition, search_algorithm)
     elif agent_type_name == 'decentralised':
+        from agent_types.decentralised import decentralised_agent_type
+        startup_profile.end_phase('agent type import')
+        startup_profile.report()
         decentralised_agent_type(level, initial_state, action_library, goal_description, frontier)
     elif agent_type_name == 'helper':
+        from agent_types.helper import helper_agent_type
+        startup_profile.end_phase('agent type import')
+        startup_profile.report()
         helper_agent_type(level, initial_state, action_library, goal_description, frontier)
     elif agent_type_name == 'nondeterministic':
+        from agent_types.non_deterministic import non_deterministic_agent_type
+        startup_profile.end_phase('agent type import')
+        startup_profile.report()
         non_deterministic_agent_type(level, initial_state, action_library, goal_description)
     elif agent_type_name == 'goalrecognition':
+        from agent_types.goal_recognition import goal_recognition_agent_type
+        startup_profile.end_phase('agent type import')
+        startup_profile.report()
         goal_recognition_agent_type(level, initial_state, action_library, goal_description, frontier)
     elif agent_type_name == 'robot':
         if not robot_ip:
             raise ValueError("You must also specify which robot ip address to use when using the robot agent type!")
+        from agent_types.robot import robot_agent_type
+        startup_profile.end_phase('agent type import')
+        startup_profile.report()
         try:
             robot_agent_type(level, initial_state, action_library, goal_description, frontier, robot_ip)
         except Exception as e:
@@ -198,3 +469,7 @@ if __name__ == '__main__':
     else:
         print(f"Unrecognized agent type! {agent_type_name}", file=sys.stderr)
 
+    # Also cache the data which was computed lazily during search
+    if level is not None:
+        level.store_cache()
+
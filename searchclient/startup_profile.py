@@ -0,0 +1,77 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import builtins
+import sys
+import time
+
+
+class StartupProfile:
+    """
+    A StartupProfile measures how the time between the start of the searchclient and the start of the search is spent.
+    The startup is divided into phases, each ended by calling end_phase, and for each phase the time spent importing
+    modules is measured as well, since most modules are only imported once they turn out to be needed.
+    Nothing is measured unless the profile is enabled, except the times at which the phases end.
+    """
+
+    def __init__(self, start_time: float):
+        self.start_time = start_time
+        self.phase_start_time = start_time
+        self.phase_import_time = 0.0
+        # A list of (phase name, duration, import time) triples
+        self.phases = []
+        self.is_enabled = False
+        self.original_import = None
+        self.import_depth = 0
+
+    def enable(self):
+        self.is_enabled = True
+        self.original_import = builtins.__import__
+        builtins.__import__ = self.timed_import
+
+    def disable(self):
+        if self.original_import is not None:
+            builtins.__import__ = self.original_import
+            self.original_import = None
+
+    def timed_import(self, *args, **kwargs):
+        # Only the outermost import is timed, since it includes the time of the imports it causes
+        if self.import_depth > 0:
+            return self.original_import(*args, **kwargs)
+        self.import_depth += 1
+        import_start_time = time.perf_counter()
+        try:
+            return self.original_import(*args, **kwargs)
+        finally:
+            self.import_depth -= 1
+            self.phase_import_time += time.perf_counter() - import_start_time
+
+    def end_phase(self, name: str, is_import: bool = False):
+        """Ends the current phase, where is_import tells that the whole phase was spent importing modules"""
+        now = time.perf_counter()
+        import_time = now - self.phase_start_time if is_import else self.phase_import_time
+        self.phases.append((name, now - self.phase_start_time, import_time))
+        self.phase_start_time = now
+        self.phase_import_time = 0.0
+
+    def report(self):
+        """Prints the phases so far to stderr and stops measuring the import time"""
+        self.disable()
+        if not self.is_enabled:
+            return
+        print("Startup profile:", file=sys.stderr)
+        for (name, duration, import_time) in self.phases:
+            print(f"  {name:<24} {duration:8.3f} s  (imports {import_time:.3f} s)", file=sys.stderr)
+        total_time = time.perf_counter() - self.start_time
+        total_import_time = sum(import_time for (_, _, import_time) in self.phases)
+        print(f"  {'total':<24} {total_time:8.3f} s  (imports {total_import_time:.3f} s)", file=sys.stderr, flush=True)
@@ -78,6 +78,82 @@ class PriorityQueue:
             return None
         return entry[0]
 
+    def contains(self, element) -> bool:
+        return element in self.entry_finder
+
+    def elements(self):
+        return self.entry_finder.keys()
+
+
+# Here we define a bucket priority queue which can be used in place of the PriorityQueue above whenever priorities are
+# integers, as is the case for the f-values of A* and Greedy search in the hospital domain. Since only few distinct
+# priorities exist at any time, all elements with the same priority are stored together in a bucket, which makes adding,
+# removing and changing the priority of an element take constant time (apart from when a bucket is created or emptied).
+# Elements with the same priority can additionally be ordered by a secondary integer 'tie_break', e.g. the h-value in
+# A* such that states closer to the goal are expanded first. Within a bucket, elements are ordered by insertion order
+# (LIFO behaviour), just like in the PriorityQueue.
+class BucketPriorityQueue:
+
+    def __init__(self):
+        # The buckets map (priority, tie_break) keys into dictionaries whose keys are the elements of the bucket.
+        # Dictionaries remember the insertion order and support removing arbitrary elements, which we use to pop
+        # elements in LIFO order and to move elements between buckets without leaving invalidated entries behind.
+        self.buckets = {}
+        # A heap containing the key of every bucket (including buckets which have become empty), such that the bucket
+        # with the lowest key can be found quickly
+        self.bucket_keys = []
+        self.entry_finder = {}
+
+    def add(self, element: h_state.HospitalState, priority: int, tie_break: int = 0):
+        key = (priority, tie_break)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = {}
+            self.buckets[key] = bucket
+            heapq.heappush(self.bucket_keys, key)
+        bucket[element] = None
+        self.entry_finder[element] = key
+
+    def change_priority(self, element: h_state.HospitalState, new_priority: int, new_tie_break: int = 0):
+        # The element is simply moved to the bucket of its new priority. Its old bucket might become empty, in which
+        # case it is removed the next time it reaches the front of the queue.
+        key = self.entry_finder.pop(element)
+        del self.buckets[key][element]
+        self.add(element, new_priority, new_tie_break)
+
+    def pop(self) -> h_state.HospitalState:
+        # Remove any empty buckets at the front of the queue
+        while True:
+            key = self.bucket_keys[0]
+            bucket = self.buckets[key]
+            if bucket:
+                break
+            del self.buckets[key]
+            heapq.heappop(self.bucket_keys)
+        state, _ = bucket.popitem()
+        del self.entry_finder[state]
+        return state
+
+    def clear(self):
+        self.buckets.clear()
+        self.bucket_keys.clear()
+        self.entry_finder.clear()
+
+    def size(self) -> int:
+        return len(self.entry_finder)
+
+    def get_priority(self, element) -> int:
+        key = self.entry_finder.get(element)
+        if key is None:
+            return None
+        return key[0]
+
+    def contains(self, element) -> bool:
+        return element in self.entry_finder
+
+    def elements(self):
+        return self.entry_finder.keys()
+
 
 class FrontierBestFirst:
 
@@ -120,6 +196,8 @@ class FrontierBestFirst:
 
 # The FrontierAStar and FrontierGreedy classes extend the FrontierBestFirst class, that is, they are
 # exact copies of the above class but where the 'f' method is replaced.
+# Since f-values are integers, FrontierBestFirst can use either the PriorityQueue or the BucketPriorityQueue, where the
+# latter also allows ties between states with the same f-value to be broken by e.g. their h-value.
 
 class FrontierAStar(FrontierBestFirst):
 
@@ -0,0 +1,146 @@
+# coding: utf-8
+#
+# Copyright 2021 The Technical University of Denmark
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import time
+import memory
+
+# Search telemetry is a stream of JSON objects, one per line, describing the progress of the searches, such that the
+# behaviour of long searches can be inspected or plotted afterwards. Every record has a 'type' field:
+# - 'startup' records hold the duration of each startup phase (see StartupProfile) in seconds.
+# - 'search' records are written by a search every interval iterations and hold the number of expanded and generated
+#   states, the rates at which states were expanded and generated since the previous record, the sizes of the frontier
+#   and the closed set, the minimum and average h-value computed since the previous record, the memory usage of the
+#   process and the time spent on computing h-values and on everything else since the previous record.
+# Searches check whether a record is due by comparing their iteration count with SearchTelemetry.next_record, so the
+# telemetry costs a single comparison per iteration in between records. Without a telemetry stream, a short status line
+# is printed to stderr instead of each search record, such that the progress of a search can still be followed.
+
+# The default number of iterations between the records (or status lines) of a search
+DEFAULT_INTERVAL = 10000
+
+_stream = None
+# The interval in use, which the searchclient sets from --telemetry-interval
+interval = DEFAULT_INTERVAL
+
+# The h-values computed and the time spent computing them since the last record of a search
+_h_count = 0
+_h_sum = 0
+_h_min = None
+_h_time = 0.0
+
+
+def open_stream(target: str):
+    """
+    Enables telemetry, writing the records to the given file path, or to the given file descriptor if the target is a
+    number (e.g. 2 for stderr, which the server prints)
+    """
+    global _stream
+    if target.isdigit():
+        _stream = os.fdopen(int(target), 'w', closefd=False)
+    else:
+        _stream = open(target, 'w')
+
+
+def write_record(record: dict):
+    if _stream is None:
+        return
+    # json is only imported once telemetry is enabled, since the startup of the searchclient is timed by the server
+    import json
+
+    # Each record is written and flushed as a single line, such that records of forked processes (e.g. the
+    # configurations of a portfolio) sharing the stream do not end up interleaved
+    _stream.write(json.dumps(record) + '\n')
+    _stream.flush()
+
+
+def record_startup(phases):
+    """Writes the (name, duration, import time) triples of a StartupProfile as a startup record"""
+    write_record({'type': 'startup', 'process': os.getpid(),
+                  'phases': {name: round(duration, 6) for (name, duration, _) in phases}})
+
+
+def observe_heuristic(heuristic):
+    """
+    Lets the telemetry record the h-values computed by the heuristic and the time spent computing them. The heuristic is
+    left untouched unless telemetry is enabled.
+    """
+    if heuristic is None or _stream is None:
+        return heuristic
+    h = heuristic.h
+
+    def observed_h(state, goal_description):
+        global _h_count, _h_sum, _h_min, _h_time
+        h_start_time = time.perf_counter()
+        value = h(state, goal_description)
+        _h_time += time.perf_counter() - h_start_time
+        _h_count += 1
+        _h_sum += value
+        if _h_min is None or value < _h_min:
+            _h_min = value
+        return value
+
+    heuristic.h = observed_h
+    return heuristic
+
+
+class SearchTelemetry:
+    """
+    A SearchTelemetry writes the search records of a single search, or prints status lines to stderr if telemetry is
+    disabled. The search should call record whenever its iteration count reaches next_record.
+    """
+
+    def __init__(self, search_name: str):
+        global _h_count, _h_sum, _h_min, _h_time
+        self.search_name = search_name
+        self.next_record = interval
+        self.start_time = time.perf_counter()
+        self.last_time = self.start_time
+        self.last_expanded = 0
+        self.last_generated = 0
+        _h_count, _h_sum, _h_min, _h_time = 0, 0, None, 0.0
+
+    def record(self, iterations: int, num_expanded: int, num_generated: int, frontier_size: int, closed_size: int):
+        global _h_count, _h_sum, _h_min, _h_time
+        self.next_record = iterations + interval
+        now = time.perf_counter()
+        if _stream is None:
+            print(f"#Expanded: {num_expanded:8d}, #Frontier: {frontier_size:8d}, #Generated: {num_generated:8d}, "
+                  f"Time: {now - self.start_time:.3f} s, Memory: {memory.get_usage() / (1024 * 1024):.2f} MB",
+                  file=sys.stderr, flush=True)
+            return
+        duration = now - self.last_time
+        num_expanded_since = num_expanded - self.last_expanded
+        num_generated_since = num_generated - self.last_generated
+        write_record({
+            'type': 'search',
+            'search': self.search_name,
+            'process': os.getpid(),
+            'time': round(now - self.start_time, 6),
+            'expanded': num_expanded,
+            'generated': num_generated,
+            'expanded_per_second': round(num_expanded_since / duration, 1) if duration > 0 else None,
+            'generated_per_second': round(num_generated_since / duration, 1) if duration > 0 else None,
+            'frontier': frontier_size,
+            'closed': closed_size,
+            'h_min': _h_min,
+            'h_avg': round(_h_sum / _h_count, 3) if _h_count > 0 else None,
+            'rss_bytes': memory.get_usage(),
+            'phases': {'heuristic': round(_h_time, 6), 'other': round(max(0.0, duration - _h_time), 6)},
+        })
+        _h_count, _h_sum, _h_min, _h_time = 0, 0, None, 0.0
+        # The time spent writing the record is left out of the next interval
+        self.last_time = time.perf_counter()
+        self.last_expanded = num_expanded
+        self.last_generated = num_generated
@@ -36,10 +36,74 @@ def joint_action_to_string(joint_action) -> str:
     return "|".join(joint_action_names)
 
 
+def plan_from_action_names(named_plan, action_set):
+    """
+    Converts a plan given as lists of action names, e.g. computed by another process, back into joint actions using
+    the actions of the action set
+    """
+    actions_by_name = [{action.name: action for action in agent_actions} for agent_actions in action_set]
+    return [[actions_by_name[agent_index][name] for (agent_index, name) in enumerate(action_names)]
+            for action_names in named_plan]
+
+
 def parse_response(response: str) -> list[bool]:
     return [part == "true" for part in response.split('|')]
 
 
+# The number of joint actions written to the server at once by execute_plan, and the maximum number of joint actions
+# sent but not yet answered. The latter bounds how many actions are executed in vain after an action fails.
+PLAN_CHUNK_SIZE = 32
+MAX_ACTIONS_IN_FLIGHT = 128
+
+
+def execute_plan(plan) -> bool:
+    """
+    Sends a fixed plan to the server and returns whether every joint action succeeded.
+    Instead of waiting for the response to each joint action before sending the next one, the joint actions are
+    written in chunks while a separate thread reads back the responses, such that the server never waits for the
+    client. The first failed joint action is still detected, after which no further chunks are sent, but the joint
+    actions already sent (at most MAX_ACTIONS_IN_FLIGHT) are still executed by the server.
+    """
+    import threading
+    condition = threading.Condition()
+    # The number of joint actions answered by the server so far, and the index of the first failed one if any
+    num_answered = 0
+    failed_index = None
+
+    def read_responses():
+        nonlocal num_answered, failed_index
+        for index in range(len(plan)):
+            # An empty line means that the server has closed the connection, which parses as a failure
+            execution_successes = parse_response(read_line())
+            with condition:
+                num_answered += 1
+                if False in execution_successes:
+                    failed_index = index
+                condition.notify()
+            if failed_index is not None:
+                return
+
+    reader = threading.Thread(target=read_responses, daemon=True)
+    reader.start()
+    for chunk_start in range(0, len(plan), PLAN_CHUNK_SIZE):
+        chunk_end = min(chunk_start + PLAN_CHUNK_SIZE, len(plan))
+        # Wait until the server has caught up enough, or stop sending if an action failed
+        with condition:
+            condition.wait_for(lambda: failed_index is not None or chunk_end - num_answered <= MAX_ACTIONS_IN_FLIGHT)
+            if failed_index is not None:
+                break
+        lines = [joint_action_to_string(joint_action) for joint_action in plan[chunk_start:chunk_end]]
+        print('\n'.join(lines), flush=True)
+        # Uncomment the below line to print the executed actions to the command line for debugging purposes
+        # print('\n'.join(lines), file=sys.stderr, flush=True)
+    reader.join()
+
+    if failed_index is not None:
+        print(f"Joint action {failed_index} ({joint_action_to_string(plan[failed_index])}) failed", file=sys.stderr)
+        return False
+    return True
+
+
 class GenericNoOp:
     """A NoOP action which is independent of a specific domain and
     therefore can be used inside domain-agnostic agent types"""